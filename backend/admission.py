@@ -0,0 +1,156 @@
+"""
+Admission control for the expensive brand endpoints.
+
+Generating a profile, suggesting music and building a playlist each hold a
+request for seconds of LLM and Spotify time. Every such route class gets a
+gate with a concurrency limit and a short, bounded wait queue, and every
+caller a request quota per window. A request that would exceed either is
+rejected right away (503 when the gate is full, 429 over quota) with a
+Retry-After header, instead of piling up behind the others and slowing
+down cheap endpoints in the same worker.
+
+Limits apply per worker process, like the Spotify rate limiter. Callers are
+identified by their Spotify user when the session header names a stored
+session or the bearer token was already confirmed by Spotify, else by client
+address: behind TRUSTED_PROXY_HOPS proxies, the address the outermost of
+them put in X-Forwarded-For rather than the proxy's own.
+Batch routes take one gate slot per unit of work rather than per request.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from .config import (
+    ADMISSION_LIMITS, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER, SESSION_HEADER, TRUSTED_PROXY_HOPS, USER_QUOTA_WINDOW,
+)
+
+logger = logging.getLogger(__name__)
+
+class AdmissionGate:
+    """At most `concurrency` requests at a time, with up to `queue_size` more waiting"""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    def _reject(self):
+        logger.warning(f"Shedding {self.name} request: {self.waiting} already waiting")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Too many {self.name} requests in progress, retry shortly",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+        )
+
+    async def acquire(self):
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        if self.waiting >= self.queue_size:
+            self._reject()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject()
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self._slots.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+class UserQuota:
+    """Fixed-window request counts per caller"""
+
+    def __init__(self, name: str, limit: int, window: float = USER_QUOTA_WINDOW):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self._counts: Dict[str, Tuple[float, int]] = defaultdict(lambda: (0.0, 0))
+
+    def check(self, caller: str):
+        now = time.monotonic()
+        started, count = self._counts[caller]
+        if now - started >= self.window:
+            started, count = now, 0
+        if count >= self.limit:
+            retry_after = math.ceil(started + self.window - now)
+            raise HTTPException(
+                status_code=429,
+                detail=f"{self.name} quota of {self.limit} requests per {int(self.window)}s exceeded",
+                headers={"Retry-After": str(retry_after)}
+            )
+        self._counts[caller] = (started, count + 1)
+        if len(self._counts) > 10000:
+            # Forget callers whose window has passed
+            for key in [key for key, (start, _) in self._counts.items() if now - start >= self.window]:
+                del self._counts[key]
+
+def client_address(request: Request, trusted_hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """The client's address as seen by the outermost trusted proxy"""
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if trusted_hops and hops:
+        # Each proxy appends the address it was connected from; entries left of ours are client-supplied
+        return hops[-min(trusted_hops, len(hops))]
+    return request.client.host if request.client else "unknown"
+
+async def _known_user(request: Request) -> Optional[str]:
+    # Unverified credentials are ignored: a made-up header per request must not buy a fresh quota
+    from .database import SessionLocal
+    from .playlist_builder import cached_user
+    from .token_store import session_user_id
+
+    session_id = request.headers.get(SESSION_HEADER)
+    if session_id:
+        db = SessionLocal()
+        try:
+            return session_user_id(db, session_id)
+        finally:
+            db.close()
+    authorization = request.headers.get("authorization")
+    if authorization:
+        user = await cached_user(authorization.replace("Bearer ", ""))
+        return user["id"] if user else None
+    return None
+
+async def caller_id(request: Request) -> str:
+    user_id = await _known_user(request)
+    return f"user:{user_id}" if user_id else client_address(request)
+
+@lru_cache(maxsize=None)
+def admission_controls(name: str) -> Tuple[AdmissionGate, UserQuota]:
+    """The gate and quota for the ADMISSION_LIMITS entry `name`, shared by every route using it"""
+    limits = ADMISSION_LIMITS[name]
+    return AdmissionGate(name, limits["concurrency"], limits["queue"]), UserQuota(name, limits["per_user"])
+
+@lru_cache(maxsize=None)
+def admission(name: str):
+    """
+    Dependency enforcing the ADMISSION_LIMITS entry `name`. The slot is held
+    until the response has been sent, including streamed responses.
+    """
+    gate, quota = admission_controls(name)
+
+    async def admit(request: Request):
+        quota.check(await caller_id(request))
+        async with gate.slot():
+            yield
+
+    return admit
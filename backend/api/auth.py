@@ -1,17 +1,25 @@
 # backend/api/auth.py
 from fastapi import APIRouter, HTTPException, Depends, Header, Body
-from spotipy.oauth2 import SpotifyOAuth
+from sqlalchemy.orm import Session
 from typing import Optional, Dict
 import logging
 import os
 
+from .. import spotify_client, token_store
+from ..config import SESSION_HEADER
+from ..database import get_db
+from ..playlist_builder import get_current_user
+
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-__all__ = ['router', 'validate_token_string']
+__all__ = ['router', 'validate_token_string', 'spotify_token', 'verified_spotify_token']
 
 def get_auth_manager():
     """Create SpotifyOAuth manager with configured scopes"""
+    from spotipy.cache_handler import MemoryCacheHandler
+    from spotipy.oauth2 import SpotifyOAuth
+
     scopes = [
         'playlist-read-private',
         'playlist-read-collaborative',
@@ -31,7 +39,9 @@ def get_auth_manager():
             client_secret=os.getenv('SPOTIFY_CLIENT_SECRET'),
             redirect_uri=redirect_uri,
             scope=' '.join(scopes),
-            open_browser=False
+            open_browser=False,
+            # Tokens live encrypted in token_store; spotipy's default would also write them in plaintext to .cache
+            cache_handler=MemoryCacheHandler()
         )
         logger.info("Created SpotifyOAuth manager")
         return auth_manager
@@ -65,8 +75,50 @@ async def login():
         logger.error(f"Error generating login URL: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def spotify_token(
+    x_session_id: Optional[str] = Header(None, alias=SESSION_HEADER),
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+) -> str:
+    """
+    Spotify access token for the request. With a session header the token
+    comes from the server-side store and is refreshed ahead of expiry;
+    otherwise the bearer token is passed through as sent.
+    """
+    if x_session_id:
+        try:
+            token = await token_store.session_access_token(db, x_session_id)
+        except Exception as e:
+            logger.error(f"Error refreshing session token: {str(e)}")
+            raise HTTPException(status_code=401, detail="Session could not be refreshed")
+        if token is None:
+            raise HTTPException(status_code=401, detail="Unknown session")
+        return token
+    if not authorization:
+        raise HTTPException(status_code=401, detail="No authorization header")
+    return authorization.replace('Bearer ', '')
+
+async def verify_token(token: str) -> str:
+    """The token, once Spotify has confirmed it (cached per token); 401 for bad credentials"""
+    try:
+        await get_current_user(spotify_client.get_client(token), token)
+    except Exception as e:
+        logger.error(f"Error verifying token: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return token
+
+async def verified_spotify_token(token: str = Depends(spotify_token)) -> str:
+    """spotify_token, for routes that serve shared results and so must not trust an unchecked bearer token"""
+    return await verify_token(token)
+
+async def start_session(db: Session, token_info: Dict) -> str:
+    """Store the user's tokens server-side; returns the session ID for the client"""
+    sp = spotify_client.get_client(token_info["access_token"])
+    user = await get_current_user(sp, token_info["access_token"])
+    return token_store.create_session(db, user["id"], token_info)
+
 @router.post("/callback")
-async def callback(code: str = Body(..., embed=True)):
+async def callback(code: str = Body(..., embed=True), db: Session = Depends(get_db)):
     """Handle Spotify OAuth callback"""
     try:
         auth_manager = get_auth_manager()
@@ -76,10 +128,18 @@ async def callback(code: str = Body(..., embed=True)):
             raise HTTPException(status_code=400, detail="Failed to get access token")
         
         logger.info("Successfully obtained access token")
+        session_id = None
+        if token_info.get("refresh_token"):
+            try:
+                session_id = await start_session(db, token_info)
+            except Exception as e:
+                # Login still works with bearer tokens; only the server-side session is unavailable
+                db.rollback()
+                logger.error(f"Error storing Spotify session: {str(e)}")
         return {
             "access_token": token_info["access_token"],
             "expires_in": token_info.get("expires_in"),
-            "refresh_token": token_info.get("refresh_token")
+            "session_id": session_id
         }
     except Exception as e:
         logger.error(f"Error in callback: {str(e)}")
@@ -103,4 +163,14 @@ async def refresh_token(refresh_token: str = Body(..., embed=True)):
         }
     except Exception as e:
         logger.error(f"Error refreshing token: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/logout")
+async def logout(
+    x_session_id: Optional[str] = Header(None, alias=SESSION_HEADER),
+    db: Session = Depends(get_db)
+):
+    """Forget the session's stored tokens"""
+    if x_session_id:
+        token_store.delete_session(db, x_session_id)
+    return {"status": "logged_out"}
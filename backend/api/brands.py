@@ -1,56 +1,103 @@
-from fastapi import APIRouter, HTTPException, Header, Depends
-from typing import Dict, List
+from fastapi import APIRouter, HTTPException, Header, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import hashlib
 import json
-import os
 import logging
-import random
 import asyncio
 import traceback
 from sqlalchemy.orm import Session
-
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from dotenv import load_dotenv
-
-# For Anthropic
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
+from sqlalchemy.orm.exc import StaleDataError
 
 # Import database and models
-from ..database import get_db
-from ..models import BrandProfile
+from ..database import get_db, SessionLocal
+from ..models import BrandProfile, BrandSuggestion, PlaylistSync
+from ..cache import cache_key, get_cache
+from ..responses import content_etag, dumps, etag_json_response, etag_response, json_response
+from .. import brand_cache
+from ..admission import admission, admission_controls, caller_id
+from ..brand_search import search_brands
+from .. import spotify_client
+from ..config import (
+    ADMISSION_LIMITS, BRAND_BATCH_CONCURRENCY, IDEMPOTENCY_TTL, PLAYLIST_FLIGHT_TTL, PLAYLIST_REPLAY_TTL, SUGGESTION_CACHE_TTL,
+    SUGGESTION_TOPUP_ROUNDS, TOPUP_TOKENS_PER_SONG,
+)
+from ..library import match_genres
+from ..llm import LLMUnavailableError, complete
+from .auth import spotify_token
+from ..single_flight import SingleFlight
+from ..playlist_builder import (
+    Progress, SuggestionResolver, brand_playlist_name, find_playlists, get_current_user, playlist_result,
+    record_sync, store_suggestions, stored_suggestions, suggestions_by_brand, sync_playlist, unresolved,
+)
 
-load_dotenv()
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Last good LLM suggestions per brand, served while the LLM circuit is open
+suggestion_cache = get_cache("brand_suggestions", default_ttl=SUGGESTION_CACHE_TTL)
+# One create-playlist run per (user, brand) across workers, and results per Idempotency-Key
+playlist_flight = SingleFlight("playlist_runs", claim_ttl=PLAYLIST_FLIGHT_TTL, result_ttl=PLAYLIST_REPLAY_TTL)
+idempotent_results = get_cache("idempotent_playlist_results", default_ttl=IDEMPOTENCY_TTL)
+
+def brand_summary(brand: BrandProfile) -> Dict:
+    return {
+        "id": brand.id,
+        "name": brand.name,
+        "description": brand.data.get("description", ""),
+        "core_identity": brand.data.get("brand_essence", {}).get("core_identity", ""),
+        "status": brand.data.get("status", "pending_approval")
+    }
+
 @router.get("")
-async def get_all_brands(db: Session = Depends(get_db)):
-    """Get all brand profiles"""
+async def get_all_brands(request: Request, include_suggestions: bool = False, db: Session = Depends(get_db)):
+    """Get all brand profiles, with their saved suggestions when include_suggestions is set"""
     try:
         brands = db.query(BrandProfile).all()
-        return {
-            "brands": [{
-                "id": brand.id,
-                "name": brand.name,
-                "description": brand.data.get("description", ""),
-                "core_identity": brand.data.get("brand_essence", {}).get("core_identity", ""),
-                "status": brand.data.get("status", "pending_approval")
-            } for brand in brands]
-        }
+        summaries = [brand_summary(brand) for brand in brands]
+        if include_suggestions:
+            saved = suggestions_by_brand(db, [brand.id for brand in brands])
+            for summary in summaries:
+                summary["suggested_songs"] = saved.get(summary["id"], [])
+        return etag_json_response(request, {"brands": summaries})
     except Exception as e:
         logger.error(f"Error getting brands: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/search")
+async def search_brand_profiles(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    """Full-text search over brand profiles, best matches first"""
+    try:
+        page, total = search_brands(db, q, limit, offset)
+        brands = {
+            brand.id: brand
+            for brand in db.query(BrandProfile).filter(BrandProfile.id.in_([brand_id for brand_id, _ in page]))
+        } if page else {}
+        results = [
+            {**brand_summary(brands[brand_id]), "score": round(score, 4)}
+            for brand_id, score in page if brand_id in brands
+        ]
+        return {"brands": results, "total": total, "limit": limit, "offset": offset}
+    except Exception as e:
+        logger.error(f"Error searching brands for {q!r}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{brand_id}")
-async def get_brand_profile(brand_id: str, db: Session = Depends(get_db)):
-    """Get a specific brand profile"""
+async def get_brand_profile(brand_id: str, request: Request, include_suggestions: bool = False, db: Session = Depends(get_db)):
+    """Get a specific brand profile, with its saved suggestions when include_suggestions is set"""
     try:
-        brand = db.query(BrandProfile).filter(BrandProfile.id == brand_id).first()
+        brand = await brand_cache.get_brand(db, brand_id)
         if not brand:
             raise HTTPException(status_code=404, detail=f"Brand not found: {brand_id}")
-        return brand.data
+        if include_suggestions:
+            return etag_json_response(request, {**brand.data, "suggested_songs": stored_suggestions(db, brand_id)})
+        return etag_response(request, brand.body)
     except HTTPException:
         raise
     except Exception as e:
@@ -61,15 +108,6 @@ async def generate_brand_profile(brand_name: str) -> Dict:
     """Generate comprehensive brand profile using Claude"""
     try:
         logger.info(f"Starting brand profile generation for {brand_name}")
-        
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            logger.error("ANTHROPIC_API_KEY not found in environment variables")
-            raise ValueError("ANTHROPIC_API_KEY not set")
-
-        logger.info("Initializing Anthropic client")
-        client = Anthropic(api_key=api_key.strip())
-        await asyncio.sleep(1)
 
         user_prompt = f"""
 You are a luxury brand strategist. For the brand "{brand_name}", create a detailed brand profile following this exact JSON structure:
@@ -161,19 +199,10 @@ Ensure the response is valid JSON and maintains this exact structure. Make the c
 """
 
         logger.info("Sending request to Claude API")
-        prompt = f"{HUMAN_PROMPT}{user_prompt}{AI_PROMPT}"
-        response = client.completions.create(
-            model="claude-2",
-            prompt=prompt,
-            max_tokens_to_sample=2000,
-            stop_sequences=[HUMAN_PROMPT]
-        )
-
-        await asyncio.sleep(1)
+        text_response = await complete(user_prompt, max_tokens=2000)
 
         logger.info("Processing Claude API response")
-        text_response = response.completion
-        logger.info(f"Raw response from Claude: {text_response}")
+        logger.debug(f"Raw response from Claude: {text_response}")
 
         json_start = text_response.find('{')
         json_end = text_response.rfind('}') + 1
@@ -204,59 +233,67 @@ Ensure the response is valid JSON and maintains this exact structure. Make the c
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise
 
-@router.post("")
+def brand_id_for(brand_name: str) -> str:
+    """Derive the brand_id used as primary key from a brand name"""
+    return brand_name.lower().replace(" ", "_")
+
+def manual_brand_template(brand_name: str) -> Dict:
+    """Empty profile for brands Claude could not describe"""
+    return {
+        "brand": brand_name,
+        "description": "",
+        "brand_essence": {
+            "core_identity": "",
+            "heritage": "",
+            "brand_voice": ""
+        },
+        "aesthetic_pillars": {
+            "visual_language": ["", "", "", "", ""],
+            "emotional_attributes": ["", "", "", "", ""],
+            "signature_elements": ["", "", "", "", ""]
+        },
+        "cultural_positioning": {
+            "philosophy": "",
+            "core_values": ["", "", "", "", ""],
+            "cultural_codes": ["", "", "", "", ""]
+        },
+        "target_mindset": {
+            "aspirations": ["", "", "", "", ""],
+            "lifestyle_attributes": ["", "", "", "", ""]
+        },
+        "brand_expressions": {
+            "tone": ["", "", "", "", ""],
+            "experience": ["", "", "", "", ""]
+        },
+        "status": "pending_manual_input"
+    }
+
+async def build_brand_profile(brand_name: str) -> Tuple[Dict, bool]:
+    """Generate a profile with Claude, falling back to the manual template; returns (profile, needs_manual_input)"""
+    try:
+        logger.info("Generating brand profile with Claude")
+        return await generate_brand_profile(brand_name), False
+    except Exception as e:
+        logger.warning(f"Claude generation failed: {str(e)}")
+        return manual_brand_template(brand_name), True
+
+@router.post("", dependencies=[Depends(admission("brand-profile"))])
 async def create_brand_profile(brand_data: Dict, db: Session = Depends(get_db)):
     """Create a new brand profile with Claude-generated assessment"""
     try:
-        logger.info(f"Starting brand profile creation for: {brand_data}")
+        logger.info(f"Starting brand profile creation for: {brand_data.get('brand')}")
         
         if "brand" not in brand_data:
             raise HTTPException(status_code=400, detail="Brand name required")
         
-        brand_id = brand_data["brand"].lower().replace(" ", "_")
+        brand_id = brand_id_for(brand_data["brand"])
         
         # Check if brand already exists
         existing_brand = db.query(BrandProfile).filter(BrandProfile.id == brand_id).first()
         if existing_brand:
             raise HTTPException(status_code=400, detail=f"Brand exists: {brand_id}")
 
-        try:
-            # Try to generate profile with Claude
-            logger.info("Generating brand profile with Claude")
-            brand_profile = await generate_brand_profile(brand_data["brand"])
-            needs_manual_input = False
-        except Exception as e:
-            logger.warning(f"Claude generation failed: {str(e)}")
-            # Fall back to manual input template
-            needs_manual_input = True
-            brand_profile = {
-                "brand": brand_data["brand"],
-                "description": "",
-                "brand_essence": {
-                    "core_identity": "",
-                    "heritage": "",
-                    "brand_voice": ""
-                },
-                "aesthetic_pillars": {
-                    "visual_language": ["", "", "", "", ""],
-                    "emotional_attributes": ["", "", "", "", ""],
-                    "signature_elements": ["", "", "", "", ""]
-                },
-                "cultural_positioning": {
-                    "philosophy": "",
-                    "core_values": ["", "", "", "", ""],
-                    "cultural_codes": ["", "", "", "", ""]
-                },
-                "target_mindset": {
-                    "aspirations": ["", "", "", "", ""],
-                    "lifestyle_attributes": ["", "", "", "", ""]
-                },
-                "brand_expressions": {
-                    "tone": ["", "", "", "", ""],
-                    "experience": ["", "", "", "", ""]
-                },
-                "status": "pending_manual_input"
-            }
+        brand_profile, needs_manual_input = await build_brand_profile(brand_data["brand"])
         
         # Create new brand profile in database
         new_brand = BrandProfile(
@@ -280,6 +317,108 @@ async def create_brand_profile(brand_data: Dict, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/batch")
+async def create_brand_profiles_batch(
+    payload: Dict, request: Request, stream: bool = False, db: Session = Depends(get_db)
+):
+    """
+    Onboard many brands at once. Existing brands are skipped, profiles are
+    generated concurrently (BRAND_BATCH_CONCURRENCY at a time, each holding a
+    brand-profile admission slot) and all new brands are inserted in one
+    transaction. A generation shed by admission control is reported as
+    "rejected". With ?stream=true the response is NDJSON: one "generated"
+    (or "rejected") event per brand as it finishes, then a "summary".
+    """
+    gate, quota = admission_controls("brand-profile")
+    quota.check(await caller_id(request))
+
+    names = payload.get("brands")
+    if not isinstance(names, list) or not names:
+        raise HTTPException(status_code=422, detail="brands must be a non-empty list of brand names")
+
+    results = {}
+    pending = {}
+    for name in names:
+        name = str(name).strip()
+        brand_id = brand_id_for(name)
+        if not name or brand_id in results or brand_id in pending:
+            continue
+        pending[brand_id] = name
+
+    # One IN query for every requested brand
+    existing_ids = {
+        row.id for row in db.query(BrandProfile.id).filter(BrandProfile.id.in_(list(pending))).all()
+    }
+    for brand_id in existing_ids:
+        results[brand_id] = {"brand": pending.pop(brand_id), "brand_id": brand_id, "status": "exists"}
+
+    # Never more of our own generations than the gate runs at once, so the batch doesn't queue behind itself
+    semaphore = asyncio.Semaphore(min(BRAND_BATCH_CONCURRENCY, ADMISSION_LIMITS["brand-profile"]["concurrency"]))
+
+    async def generate(brand_id: str, name: str):
+        async with semaphore:
+            try:
+                async with gate.slot():
+                    profile, needs_manual_input = await build_brand_profile(name)
+            except HTTPException as e:
+                # Shed by admission control; the other brands go ahead
+                return brand_id, name, None, False, e.detail
+        return brand_id, name, profile, needs_manual_input, None
+
+    async def run_batch():
+        generated = []
+        for finished in asyncio.as_completed([generate(brand_id, name) for brand_id, name in pending.items()]):
+            brand_id, name, profile, needs_manual_input, rejected = await finished
+            if rejected:
+                results[brand_id] = {"brand": name, "brand_id": brand_id, "status": "rejected", "detail": rejected}
+                yield {"event": "rejected", **results[brand_id]}
+                continue
+            generated.append((brand_id, name, profile))
+            results[brand_id] = {
+                "brand": name,
+                "brand_id": brand_id,
+                "status": "generated",
+                "needs_manual_input": needs_manual_input
+            }
+            yield {"event": "generated", **results[brand_id]}
+
+        # Insert everything in a single transaction on a session owned by this generator,
+        # since a streamed body outlives the request's dependencies
+        session = SessionLocal()
+        try:
+            session.add_all([BrandProfile(id=brand_id, name=name, data=profile) for brand_id, name, profile in generated])
+            session.commit()
+            status = "created"
+        except Exception as e:
+            logger.error(f"Error inserting brand batch: {str(e)}", exc_info=True)
+            session.rollback()
+            status = "failed"
+        finally:
+            session.close()
+        for brand_id, _, _ in generated:
+            results[brand_id]["status"] = status
+
+        yield {
+            "event": "summary",
+            "created": sum(1 for result in results.values() if result["status"] == "created"),
+            "skipped": len(existing_ids),
+            "failed": sum(1 for result in results.values() if result["status"] == "failed"),
+            "rejected": sum(1 for result in results.values() if result["status"] == "rejected"),
+            "results": list(results.values())
+        }
+
+    if stream:
+        async def ndjson():
+            async for event in run_batch():
+                yield dumps(event) + b"\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    summary = None
+    async for event in run_batch():
+        summary = event
+    summary.pop("event")
+    return json_response(summary)
+
 @router.post("/{brand_id}/approve")
 async def approve_brand_profile(brand_id: str, db: Session = Depends(get_db)):
     """Approve a brand profile to enable playlist creation"""
@@ -288,115 +427,270 @@ async def approve_brand_profile(brand_id: str, db: Session = Depends(get_db)):
         if not brand:
             raise HTTPException(status_code=404, detail=f"Brand not found: {brand_id}")
 
-        # Update status in the JSON data
-        brand_data = brand.data
-        brand_data["status"] = "approved"
-        brand.data = brand_data
+        # Update status in the JSON data (assign a new dict so the change is detected)
+        brand.data = {**brand.data, "status": "approved"}
         
         db.commit()
+        await brand_cache.invalidate(brand_id)
         return {"message": "Brand profile approved"}
     except HTTPException:
         raise
+    except StaleDataError:
+        db.rollback()
+        await brand_cache.invalidate(brand_id)
+        raise HTTPException(status_code=409, detail="Brand profile was changed concurrently, retry")
     except Exception as e:
         logger.error(f"Error approving brand {brand_id}: {str(e)}")
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/suggest-music")
-async def suggest_music(brand_profile: Dict):
-    """Suggest music for an approved brand profile"""
-    try:
-        # Check if brand is approved
-        if brand_profile.get("status") != "approved":
-            raise HTTPException(
-                status_code=400,
-                detail="Brand profile must be approved before suggesting music"
-            )
-
-        logger.info("Starting suggest-music endpoint")
-        logger.info(f"Brand Profile: {brand_profile}")
-        
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            logger.error("ANTHROPIC_API_KEY not found")
-            raise ValueError("ANTHROPIC_API_KEY not set")
-            
-        logger.info("Got API key, initializing Anthropic client")
-        client = Anthropic(api_key=api_key.strip())
-
-        await asyncio.sleep(1)
-
-        brand_name = brand_profile.get("brand", "Unknown Brand")
-        core_identity = brand_profile.get("brand_essence", {}).get("core_identity", "")
-        brand_values = brand_profile.get("cultural_positioning", {}).get("core_values", [])
-        target_mindset = brand_profile.get("target_mindset", {})
-
-        user_prompt = f"""
-You are a music curator. Suggest 10 songs that match this brand:
+async def fallback_suggestions(brand_profile: Dict) -> Dict:
+    """Suggestions without the LLM: the brand's last good suggestions, else matching library genres"""
+    brand_name = brand_profile.get("brand", "Unknown Brand")
+    cached = await suggestion_cache.aget(brand_name.lower())
+    if cached:
+        return {"suggestions": cached, "fallback": "cache"}
+    return {"suggestions": [], "fallback": "library", "genres": match_genres(brand_profile)}
+
+def music_prompt(brand_profile: Dict, count: int, exclude: Optional[List[Dict]] = None) -> str:
+    """Prompt asking for `count` songs for a brand, none of the `exclude` songs"""
+    brand_name = brand_profile.get("brand", "Unknown Brand")
+    core_identity = brand_profile.get("brand_essence", {}).get("core_identity", "")
+    brand_values = brand_profile.get("cultural_positioning", {}).get("core_values", [])
+    target_mindset = brand_profile.get("target_mindset", {})
+
+    exclusions = ""
+    if exclude:
+        songs = "\n".join(f"- {item['track']} by {item['artist']}" for item in exclude)
+        exclusions = f"\nDo not suggest any of these songs:\n{songs}\n"
+
+    return f"""
+You are a music curator. Suggest {count} songs that match this brand:
 Brand: {brand_name}
 Identity: {core_identity}
 Values: {', '.join(brand_values)}
 Target Mindset: {json.dumps(target_mindset)}
-
+{exclusions}
 Format each suggestion as:
 Song: [title]
 Artist: [artist name]
 Why it fits: [one sentence explaining how it matches the brand values and identity]
 """
 
-        prompt = f"{HUMAN_PROMPT}{user_prompt}{AI_PROMPT}"
-        logger.info("Sending request to Anthropic using completions.create()")
-        response = client.completions.create(
-            model="claude-2",
-            prompt=prompt,
-            max_tokens_to_sample=1500,
-            stop_sequences=[HUMAN_PROMPT]
-        )
+def parse_suggestions(text_response: str) -> List[Dict]:
+    """Song/Artist/Why it fits blocks of an LLM response as suggestion dicts"""
+    suggestions = []
+    song_sections = text_response.split("\n\n")
+    for section in song_sections:
+        if "Song:" in section and "Artist:" in section:
+            lines = section.strip().split("\n")
+            track_line = lines[0].replace("Song:", "").strip()
+            artist_line = lines[1].replace("Artist:", "").strip()
+            reason_line = ""
+            if len(lines) > 2:
+                reason_line = " ".join(lines[2:]).replace("Why it fits:", "").strip()
+
+            suggestions.append({
+                "track": track_line,
+                "artist": artist_line,
+                "reason": reason_line
+            })
+    return suggestions
+
+@router.post("/suggest-music", dependencies=[Depends(admission("suggest-music"))])
+async def suggest_music(brand_profile: Dict):
+    """Suggest music for an approved brand profile"""
+    try:
+        # Check if brand is approved
+        if brand_profile.get("status") != "approved":
+            raise HTTPException(
+                status_code=400,
+                detail="Brand profile must be approved before suggesting music"
+            )
 
-        await asyncio.sleep(1)
+        logger.info(f"Starting suggest-music for {brand_profile.get('brand')}")
+        logger.debug(f"Brand Profile: {brand_profile}")
 
-        text_response = response.completion
-        logger.info(f"Anthropic response:\n{text_response}")
+        brand_name = brand_profile.get("brand", "Unknown Brand")
+        user_prompt = music_prompt(brand_profile, 10)
 
-        suggestions = []
-        song_sections = text_response.split("\n\n")
-        for section in song_sections:
-            if "Song:" in section and "Artist:" in section:
-                lines = section.strip().split("\n")
-                track_line = lines[0].replace("Song:", "").strip()
-                artist_line = lines[1].replace("Artist:", "").strip()
-                reason_line = ""
-                if len(lines) > 2:
-                    reason_line = " ".join(lines[2:]).replace("Why it fits:", "").strip()
+        logger.info("Sending request to Anthropic")
+        try:
+            text_response = await complete(user_prompt, max_tokens=1500)
+        except LLMUnavailableError as e:
+            logger.warning(f"LLM unavailable for {brand_name}, using fallback suggestions: {str(e)}")
+            return json_response(await fallback_suggestions(brand_profile))
 
-                suggestions.append({
-                    "track": track_line,
-                    "artist": artist_line,
-                    "reason": reason_line
-                })
+        logger.debug(f"Anthropic response:\n{text_response}")
 
-        return {"suggestions": suggestions}
+        suggestions = parse_suggestions(text_response)
+        if suggestions:
+            await suggestion_cache.aset(brand_name.lower(), suggestions)
+        return json_response({"suggestions": suggestions})
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in suggest-music: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/create-playlist")
-async def create_brand_playlist(payload: Dict, authorization: str = Header(None), db: Session = Depends(get_db)):
-    """Create or update playlist for an approved brand"""
+async def _current_user_id(sp, token: str) -> str:
+    try:
+        user_id = (await get_current_user(sp, token))["id"]
+        logger.info(f"Creating playlist for user: {user_id}")
+        return user_id
+    except Exception as e:
+        logger.error(f"Error getting user profile: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+async def top_up_suggestions(
+    resolver: SuggestionResolver,
+    brand_profile: Dict,
+    suggestions: List[Dict],
+    progress: Progress = None
+) -> List[Dict]:
+    """
+    Replacements for resolved suggestions that were not found on Spotify.
+    The LLM is asked only for as many songs as are missing, with every song
+    tried so far excluded, for at most SUGGESTION_TOPUP_ROUNDS rounds.
+    Returns the replacements that resolved.
+    """
+    tried = list(suggestions)
+    added = []
+    for round_number in range(1, SUGGESTION_TOPUP_ROUNDS + 1):
+        missing = sum(1 for item in suggestions if not item.get('spotify_data')) - len(added)
+        if missing <= 0:
+            break
+        if progress:
+            progress({"event": "top_up", "round": round_number, "requested": missing})
+
+        try:
+            text_response = await complete(
+                music_prompt(brand_profile, missing, exclude=tried), max_tokens=TOPUP_TOKENS_PER_SONG * missing + 100
+            )
+        except LLMUnavailableError as e:
+            logger.warning(f"LLM unavailable, playlist stays {missing} songs short: {str(e)}")
+            break
+
+        seen = {(item['track'].lower(), item['artist'].lower()) for item in tried}
+        candidates = [
+            item for item in parse_suggestions(text_response)
+            if (item['track'].lower(), item['artist'].lower()) not in seen
+        ][:missing]
+        if not candidates:
+            break
+        tried.extend(candidates)
+        await resolver.resolve_all(candidates, progress=progress)
+        added.extend(item for item in candidates if item.get('spotify_data'))
+    return added
+
+async def build_brand_playlist(
+    sp,
+    user_id: str,
+    brand_id: str,
+    brand_name: str,
+    suggestions: List[Dict],
+    progress: Progress = None,
+    top_up_profile: Optional[Dict] = None
+) -> Dict:
+    """
+    Resolve suggestions, sync the brand playlist and save the outcome; returns
+    the create-playlist result. With top_up_profile (the brand profile), songs
+    that were not found are replaced through top_up_suggestions first.
+    """
+    playlist_name = brand_playlist_name(brand_name)
+    resolver = SuggestionResolver(sp)
+    # Suggestions start resolving while the user's playlists are scanned
+    existing, (new_track_uris, not_found) = await asyncio.gather(
+        find_playlists(sp, user_id, [playlist_name]),
+        resolver.resolve_all(suggestions, progress=progress)
+    )
+    topped_up = []
+    if top_up_profile and not_found:
+        topped_up = await top_up_suggestions(resolver, top_up_profile, suggestions, progress)
+        new_track_uris += [item['spotify_data']['uri'] for item in topped_up]
+        suggestions = suggestions + topped_up
+    playlist_id = await sync_playlist(
+        sp, user_id, brand_name, existing.get(playlist_name), new_track_uris, progress=progress
+    )
+
+    # Own session: the run can outlive the request that started it (streaming, shared flights)
+    session = SessionLocal()
+    try:
+        store_suggestions(session, brand_id, suggestions)
+        record_sync(session, brand_id, user_id, playlist_id, suggestions)
+        session.commit()
+    finally:
+        session.close()
+    result = playlist_result(playlist_id, new_track_uris, not_found, suggestions)
+    if top_up_profile:
+        result["topped_up"] = [f"{item['track']} by {item['artist']}" for item in topped_up]
+    return result
+
+async def _replay(result: Dict) -> Tuple[Dict, bool]:
+    return result, True
+
+def _playlist_events(run: Callable[[Progress], Awaitable[Tuple[Dict, bool]]], brand_id: str):
+    """
+    NDJSON progress of a create-playlist run: a "track" event per suggestion
+    as it resolves, "playlist" once it is located or created, "write" per
+    batch of tracks written, then "summary" (or "error"). A request sharing
+    another request's run only gets the summary.
+    """
+    async def ndjson():
+        queue = asyncio.Queue()
+
+        async def forward():
+            try:
+                result, shared = await run(queue.put_nowait)
+                queue.put_nowait({"event": "summary", "shared": shared, **result})
+            except Exception as e:
+                logger.error(f"Error creating playlist for {brand_id}: {str(e)}", exc_info=True)
+                queue.put_nowait({"event": "error", "detail": str(e)})
+            finally:
+                queue.put_nowait(None)
+
+        task = asyncio.create_task(forward())
+        try:
+            while (event := await queue.get()) is not None:
+                yield dumps(event) + b"\n"
+        finally:
+            # Only stops forwarding; the run itself finishes for requests sharing it
+            task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.post("/create-playlist", dependencies=[Depends(admission("create-playlist"))])
+async def create_brand_playlist(
+    payload: Dict,
+    stream: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    token: str = Depends(spotify_token),
+    db: Session = Depends(get_db)
+):
+    """
+    Create or update playlist for an approved brand. With ?stream=true the
+    response is NDJSON progress events ending with the summary.
+
+    With "top_up": true in the payload, songs not found on Spotify are
+    replaced by asking the LLM for just that many new ones.
+
+    Only one run per user, brand and request body happens at a time: a
+    concurrent identical request (double click, client retry) gets the result
+    of the run in flight, as does a repeat within PLAYLIST_REPLAY_TTL; a
+    different suggestion list starts its own run. With an Idempotency-Key header
+    the result is replayed for that key for IDEMPOTENCY_TTL; reusing the key
+    for a different brand or body is a 422.
+    """
     try:
-        if not authorization:
-            raise HTTPException(status_code=401, detail="No authorization header")
-            
-        token = authorization.replace('Bearer ', '')
         brand_id = payload.get("brand_id")
         suggestions = payload.get("suggestions")
 
         if not all([brand_id, suggestions]):
             raise HTTPException(status_code=422, detail="Missing required fields")
+        suggestions = unresolved(suggestions)
 
-        # Get brand from database
-        brand = db.query(BrandProfile).filter(BrandProfile.id == brand_id).first()
+        brand = await brand_cache.get_brand(db, brand_id)
         if not brand:
             raise HTTPException(status_code=404, detail=f"Brand not found: {brand_id}")
 
@@ -407,154 +701,142 @@ async def create_brand_playlist(payload: Dict, authorization: str = Header(None)
                 detail="Brand profile must be approved before creating playlist"
             )
 
-        # Store suggestions in brand profile
-        brand_data = brand.data
-        brand_data['suggested_songs'] = suggestions
-        brand.data = brand_data
-        db.commit()
-
         # Create Spotify client with access token
-        sp = spotipy.Spotify(auth=token)
-        
-        try:
-            user_id = sp.current_user()["id"]
-            logger.info(f"Creating playlist for user: {user_id}")
-        except Exception as e:
-            logger.error(f"Error getting user profile: {str(e)}")
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-        await asyncio.sleep(1)
+        sp = spotify_client.get_client(token)
+        user_id = await _current_user_id(sp, token)
+
+        # Only the same request shares a run: the body decides what the playlist gets
+        run_body = dumps({"suggestions": suggestions, "top_up": bool(payload.get("top_up"))}, sort_keys=True)
+        body_hash = hashlib.sha256(brand.id.encode() + b"\n" + run_body).hexdigest()
+
+        replay_key = cache_key(user_id, idempotency_key) if idempotency_key else None
+        if replay_key:
+            replayed = await idempotent_results.aget(replay_key)
+            if replayed is not None:
+                if replayed["body_hash"] != body_hash:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+                if stream:
+                    return _playlist_events(lambda progress: _replay(replayed["result"]), brand.id)
+                return json_response(replayed["result"], headers={"Idempotent-Replayed": "true"})
+
+        async def run(progress: Progress = None) -> Tuple[Dict, bool]:
+            result, shared = await playlist_flight.run(
+                cache_key(user_id, brand.id, run_body.decode()),
+                lambda: build_brand_playlist(
+                    sp, user_id, brand.id, brand.name, suggestions, progress,
+                    top_up_profile=brand.data if payload.get("top_up") else None
+                )
+            )
+            if replay_key:
+                await idempotent_results.aset(replay_key, {"body_hash": body_hash, "result": result})
+            return result, shared
 
-        playlist_name = f"{brand.name} Brand Playlist"
-        description = f"A curated playlist for {brand.name}"
+        if stream:
+            return _playlist_events(run, brand.id)
 
-        # Search for existing playlist
-        existing_playlist = None
-        offset = 0
-        limit = 50
-        
-        while True:
-            playlists = sp.user_playlists(user_id, limit=limit, offset=offset)
-            logger.info(f"Checking batch of {len(playlists['items'])} playlists")
-            
-            for pl in playlists['items']:
-                if pl['name'] == playlist_name:
-                    existing_playlist = pl
-                    logger.info(f"Found existing playlist: {pl['id']}")
-                    break
-
-            if existing_playlist or not playlists['next']:
-                break
-                
-            offset += limit
-            await asyncio.sleep(0.5)
-
-        # Search for new tracks
-        new_track_uris = []
-        not_found = []
-        for item in suggestions:
-            try:
-                await asyncio.sleep(0.2)
-                
-                query = f"track:{item['track']} artist:{item['artist']}"
-                results = sp.search(q=query, type='track', limit=1)
-                if results['tracks']['items']:
-                    track = results['tracks']['items'][0]
-                    new_track_uris.append(track['uri'])
-                    item['spotify_data'] = {
-                        'uri': track['uri'],
-                        'preview_url': track['preview_url'],
-                        'external_url': track['external_urls']['spotify']
-                    }
-                else:
-                    not_found.append(f"{item['track']} by {item['artist']}")
-            except Exception as e:
-                logger.error(f"Error searching for track {item['track']}: {str(e)}")
-                continue
-
-        # Update brand profile with Spotify track data
-        brand_data['suggested_songs'] = suggestions
-        brand.data = brand_data
-        db.commit()
+        try:
+            result, shared = await run()
+        except Exception as e:
+            logger.error(f"Error creating playlist: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Failed to create playlist")
+        return json_response(result, headers={"Idempotent-Replayed": "true"} if shared else None)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating or updating playlist: {str(e)}", exc_info=True)
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if existing_playlist:
-            playlist_id = existing_playlist['id']
-            logger.info(f"Updating existing playlist: {playlist_id}")
-            
-            # Get current tracks
-            current_tracks = []
-            results = sp.playlist_items(playlist_id)
-            while results:
-                current_tracks.extend([item['track']['uri'] for item in results['items'] if item['track']])
-                if results['next']:
-                    results = sp.next(results)
-                    await asyncio.sleep(0.5)
-                else:
-                    break
-
-            total_tracks = len(current_tracks)
-            if total_tracks > 0:
-                # Keep half of the existing tracks
-                tracks_to_keep = total_tracks // 2
-                kept_tracks = random.sample(current_tracks, min(tracks_to_keep, len(current_tracks)))
-                
-                # Remove all current tracks and add back kept tracks + new tracks
-                logger.info(f"Replacing playlist tracks. Keeping {len(kept_tracks)} existing tracks")
-                all_tracks = kept_tracks + new_track_uris[:total_tracks - len(kept_tracks)]
-                
-                await asyncio.sleep(1)
-                sp.playlist_replace_items(playlist_id, all_tracks)
+@router.post("/create-playlists", dependencies=[Depends(admission("create-playlist"))])
+async def create_brand_playlists(payload: Dict, token: str = Depends(spotify_token), db: Session = Depends(get_db)):
+    """
+    Create or update playlists for many approved brands in one pipeline.
+    The user profile and playlist index are fetched once, songs suggested by
+    several brands are searched once, and the brands sync concurrently.
+    Suggestions default to those stored on each brand; payload["suggestions"]
+    may override them per brand_id.
+    """
+    try:
+        brand_ids = payload.get("brand_ids")
+        overrides = payload.get("suggestions") or {}
+        if not isinstance(brand_ids, list) or not brand_ids:
+            raise HTTPException(status_code=422, detail="brand_ids must be a non-empty list")
+
+        brands = {brand.id: brand for brand in db.query(BrandProfile).filter(BrandProfile.id.in_(brand_ids)).all()}
+        saved = suggestions_by_brand(db, [brand_id for brand_id in brand_ids if brand_id not in overrides])
+        results = {}
+        ready = []
+        for brand_id in dict.fromkeys(brand_ids):
+            brand = brands.get(brand_id)
+            if not brand:
+                results[brand_id] = {"status": "not_found"}
+            elif brand.data.get("status") != "approved":
+                results[brand_id] = {"status": "not_approved"}
+            elif not (overrides.get(brand_id) or saved.get(brand_id)):
+                results[brand_id] = {"status": "no_suggestions"}
             else:
-                # If playlist is empty, just add all new tracks
-                if new_track_uris:
-                    await asyncio.sleep(1)
-                    sp.playlist_add_items(playlist_id, new_track_uris)
-            
-        else:
-            logger.info("Creating new playlist")
-            try:
-                await asyncio.sleep(1)
-                
-                new_playlist = sp.user_playlist_create(
-                    user=user_id,
-                    name=playlist_name,
-                    public=False,
-                    description=description
-                )
-                playlist_id = new_playlist['id']
-                if new_track_uris:
-                    await asyncio.sleep(1)
-                    sp.playlist_add_items(playlist_id, new_track_uris)
-            except Exception as e:
-                logger.error(f"Error creating playlist: {str(e)}")
-                raise HTTPException(status_code=500, detail="Failed to create playlist")
-
-        return {
-            "playlist_id": playlist_id,
-            "tracks_added": len(new_track_uris),
-            "tracks_not_found": not_found,
-            "playlist_url": f"https://open.spotify.com/playlist/{playlist_id}"
-        }
+                ready.append((brand, unresolved(overrides.get(brand_id) or saved[brand_id])))
+
+        if ready:
+            sp = spotify_client.get_client(token)
+            user_id = await _current_user_id(sp, token)
+            existing = await find_playlists(sp, user_id, [brand_playlist_name(brand.name) for brand, _ in ready])
+            resolver = SuggestionResolver(sp)
+
+            async def build(brand, suggestions):
+                try:
+                    new_track_uris, not_found = await resolver.resolve_all(suggestions)
+                    playlist_id = await sync_playlist(
+                        sp, user_id, brand.name, existing.get(brand_playlist_name(brand.name)), new_track_uris
+                    )
+                    return brand, suggestions, {"status": "synced", **playlist_result(playlist_id, new_track_uris, not_found, suggestions)}
+                except Exception as e:
+                    logger.error(f"Error building playlist for {brand.id}: {str(e)}", exc_info=True)
+                    return brand, suggestions, {"status": "failed", "error": str(e)}
+
+            for brand, suggestions, result in await asyncio.gather(*[build(brand, suggestions) for brand, suggestions in ready]):
+                results[brand.id] = result
+                if result["status"] == "synced":
+                    store_suggestions(db, brand.id, suggestions)
+                    record_sync(db, brand.id, user_id, result["playlist_id"], suggestions)
+            db.commit()
+
+        return {"results": results}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error creating or updating playlist: {str(e)}", exc_info=True)
+        logger.error(f"Error creating brand playlists: {str(e)}", exc_info=True)
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/{brand_id}")
-async def update_brand_profile(brand_id: str, brand_data: Dict, db: Session = Depends(get_db)):
-    """Update an existing brand profile"""
+async def update_brand_profile(
+    brand_id: str,
+    brand_data: Dict,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Update an existing brand profile. Send the ETag from GET as If-Match to
+    have the update rejected (412) when the profile changed since it was read.
+    """
     try:
         brand = db.query(BrandProfile).filter(BrandProfile.id == brand_id).first()
         if not brand:
             raise HTTPException(status_code=404, detail=f"Brand not found: {brand_id}")
+        if if_match and if_match.strip() != content_etag(dumps(brand.data, sort_keys=True)):
+            raise HTTPException(status_code=412, detail="Brand profile changed since it was read")
 
         brand.data = brand_data
         db.commit()
+        await brand_cache.invalidate(brand_id)
         return {"message": "Brand profile updated"}
     except HTTPException:
         raise
+    except StaleDataError:
+        db.rollback()
+        await brand_cache.invalidate(brand_id)
+        raise HTTPException(status_code=409, detail="Brand profile was changed concurrently, retry")
     except Exception as e:
         logger.error(f"Error updating brand {brand_id}: {str(e)}")
         db.rollback()
@@ -568,9 +850,19 @@ async def delete_brand_profile(brand_id: str, db: Session = Depends(get_db)):
         if not brand:
             raise HTTPException(status_code=404, detail=f"Brand not found: {brand_id}")
 
+        # Explicit, since SQLite does not enforce the ON DELETE CASCADE foreign keys
+        db.query(BrandSuggestion).filter(BrandSuggestion.brand_id == brand_id).delete(synchronize_session=False)
+        db.query(PlaylistSync).filter(PlaylistSync.brand_id == brand_id).delete(synchronize_session=False)
         db.delete(brand)
         db.commit()
+        await brand_cache.invalidate(brand_id)
         return {"message": "Brand profile deleted"}
+    except HTTPException:
+        raise
+    except StaleDataError:
+        db.rollback()
+        await brand_cache.invalidate(brand_id)
+        raise HTTPException(status_code=409, detail="Brand profile was changed concurrently, retry")
     except Exception as e:
         logger.error(f"Error deleting brand {brand_id}: {str(e)}", exc_info=True)
         db.rollback()
@@ -1,13 +1,25 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict
 from datetime import datetime
 from pydantic import BaseModel, Field
+import logging
 
-from backend.database import get_db
+from backend import spotify_client
+from backend.api.auth import spotify_token
+from backend.config import PLAYLIST_MIRROR_SYNC_TTL, TRACK_HYDRATION_LIMIT
+from backend.database import get_db, SessionLocal
 from backend.models import Playlist, Track, BrandProfile, playlist_tracks
+from backend.playlist_builder import get_current_user
+from backend.playlist_mirror import is_stale, library_synced_at, mirror_user_playlists, user_library, user_playlist
+from backend.responses import etag_json_response, json_response
+from backend.single_flight import SingleFlight
+from backend.track_hydration import hydrate_tracks
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+# One mirror run per user at a time across workers
+mirror_flight = SingleFlight("playlist_mirror", claim_ttl=PLAYLIST_MIRROR_SYNC_TTL, result_ttl=5)
 
 # Pydantic models for request/response validation
 class PlaylistCreate(BaseModel):
@@ -24,6 +36,7 @@ class PlaylistResponse(BaseModel):
     description: Optional[str]
     spotify_id: Optional[str]
     meta_data: Optional[Dict]
+    snapshot_id: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
@@ -48,7 +61,132 @@ class TrackResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+# Mirror of the user's Spotify playlists
+async def _user_id(token: str) -> str:
+    try:
+        return (await get_current_user(spotify_client.get_client(token), token))["id"]
+    except Exception as e:
+        logger.error(f"Error getting user profile: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+async def sync_user_library(token: str, user_id: str) -> Dict:
+    """Mirror the user's playlists, sharing a run already in progress for them"""
+    async def mirror():
+        db = SessionLocal()
+        try:
+            return await mirror_user_playlists(spotify_client.get_client(token), db, user_id)
+        finally:
+            db.close()
+
+    result, _ = await mirror_flight.run(user_id, mirror)
+    return result
+
+async def _refresh_in_background(token: str, user_id: str):
+    try:
+        await sync_user_library(token, user_id)
+    except Exception as e:
+        logger.error(f"Background playlist mirror for {user_id} failed: {str(e)}")
+
+def library_entry(playlist: Playlist, user_id: str) -> Dict:
+    """A mirrored playlist in the shape of Spotify's playlist listing, as the given user sees it"""
+    meta = playlist.meta_data or {}
+    owner = meta.get("owner") or {}
+    return {
+        "id": playlist.spotify_id,
+        "name": playlist.name,
+        "description": playlist.description,
+        "images": meta.get("images", []),
+        "tracks": {"total": meta.get("total_tracks", 0)},
+        "owner": {"display_name": owner.get("display_name")},
+        "isOwner": owner.get("id") == user_id,
+        "snapshot_id": playlist.snapshot_id
+    }
+
+@router.post("/sync")
+async def sync_playlists(token: str = Depends(spotify_token)):
+    """Mirror the user's Spotify playlists now; only playlists with a new snapshot are re-read"""
+    user_id = await _user_id(token)
+    try:
+        return await sync_user_library(token, user_id)
+    except Exception as e:
+        logger.error(f"Error mirroring playlists for {user_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=502, detail="Could not read playlists from Spotify")
+
+@router.get("/user")
+async def get_user_playlists(
+    background_tasks: BackgroundTasks,
+    token: str = Depends(spotify_token),
+    db: Session = Depends(get_db)
+):
+    """
+    The user's playlists from the local mirror. The first call mirrors the
+    library inline; afterwards a mirror older than PLAYLIST_MIRROR_MAX_AGE is
+    still served, marked stale, and refreshed in the background.
+    """
+    user_id = await _user_id(token)
+    synced_at = library_synced_at(db, user_id)
+    if synced_at is None:
+        # Never mirrored; an empty library that was mirrored is served like any other
+        try:
+            await sync_user_library(token, user_id)
+        except Exception as e:
+            logger.error(f"Error mirroring playlists for {user_id}: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=502, detail="Could not read playlists from Spotify")
+        db.expire_all()
+        synced_at = library_synced_at(db, user_id)
+
+    stale = is_stale(synced_at)
+    if stale:
+        background_tasks.add_task(_refresh_in_background, token, user_id)
+    return json_response({
+        "playlists": [library_entry(playlist, user_id) for playlist, _ in user_library(db, user_id)],
+        "synced_at": synced_at.isoformat() if synced_at else None,
+        "stale": stale
+    })
+
+@router.get("/user/{spotify_playlist_id}/tracks")
+async def get_user_playlist_tracks(
+    spotify_playlist_id: str,
+    request: Request,
+    token: str = Depends(spotify_token),
+    db: Session = Depends(get_db)
+):
+    """Tracks of a playlist in the user's mirrored library in playlist order, with the snapshot they belong to"""
+    user_id = await _user_id(token)
+    found = user_playlist(db, user_id, spotify_playlist_id)
+    if not found:
+        # Also for playlists mirrored only for other users, which may be private
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    playlist, synced_at = found
+    return etag_json_response(request, {
+        "tracks": [track.to_dict() for track in playlist.tracks],
+        "snapshot_id": playlist.snapshot_id,
+        "synced_at": synced_at.isoformat() if synced_at else None,
+        "stale": is_stale(synced_at)
+    })
+
+@router.post("/tracks/hydrate")
+async def hydrate_stored_tracks(
+    limit: int = TRACK_HYDRATION_LIMIT,
+    token: str = Depends(spotify_token),
+    db: Session = Depends(get_db)
+):
+    """Fill in or refresh metadata of stored tracks, 50 per Spotify call"""
+    try:
+        return await hydrate_tracks(spotify_client.get_client(token), db, limit)
+    except Exception as e:
+        logger.error(f"Error hydrating tracks: {str(e)}", exc_info=True)
+        db.rollback()
+        raise HTTPException(status_code=502, detail="Could not read tracks from Spotify")
+
 # Playlist endpoints
+# These manage brand playlists; mirrored library playlists (no brand) are only served per user above
+def _brand_playlist(db: Session, playlist_id: str) -> Playlist:
+    playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.brand_id.is_not(None)).first()
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return playlist
+
 @router.post("/playlists/", response_model=PlaylistResponse)
 async def create_playlist(playlist: PlaylistCreate, db: Session = Depends(get_db)):
     # Verify brand exists
@@ -70,27 +208,26 @@ async def create_playlist(playlist: PlaylistCreate, db: Session = Depends(get_db
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
-    return db_playlist
+    return json_response(db_playlist.to_dict())
 
 @router.get("/playlists/", response_model=List[PlaylistResponse])
 async def get_playlists(
+    request: Request,
     brand_id: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db)
 ):
-    query = db.query(Playlist)
+    query = db.query(Playlist).filter(Playlist.brand_id.is_not(None))
     if brand_id:
         query = query.filter(Playlist.brand_id == brand_id)
     playlists = query.offset(skip).limit(limit).all()
-    return playlists
+    return etag_json_response(request, [playlist.to_dict() for playlist in playlists])
 
 @router.get("/playlists/{playlist_id}", response_model=PlaylistResponse)
-async def get_playlist(playlist_id: str, db: Session = Depends(get_db)):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-    if not playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
-    return playlist
+async def get_playlist(playlist_id: str, request: Request, db: Session = Depends(get_db)):
+    playlist = _brand_playlist(db, playlist_id)
+    return etag_json_response(request, playlist.to_dict())
 
 @router.put("/playlists/{playlist_id}", response_model=PlaylistResponse)
 async def update_playlist(
@@ -98,9 +235,7 @@ async def update_playlist(
     playlist_update: PlaylistCreate,
     db: Session = Depends(get_db)
 ):
-    db_playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-    if not db_playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
+    db_playlist = _brand_playlist(db, playlist_id)
 
     # Update playlist attributes
     for key, value in playlist_update.dict(exclude_unset=True).items():
@@ -112,13 +247,11 @@ async def update_playlist(
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
-    return db_playlist
+    return json_response(db_playlist.to_dict())
 
 @router.delete("/playlists/{playlist_id}")
 async def delete_playlist(playlist_id: str, db: Session = Depends(get_db)):
-    db_playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-    if not db_playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
+    db_playlist = _brand_playlist(db, playlist_id)
 
     try:
         db.delete(db_playlist)
@@ -137,9 +270,7 @@ async def add_track_to_playlist(
     db: Session = Depends(get_db)
 ):
     # Verify playlist exists
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-    if not playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
+    playlist = _brand_playlist(db, playlist_id)
 
     # Check if track already exists
     db_track = db.query(Track).filter(Track.spotify_id == track.spotify_id).first()
@@ -163,14 +294,12 @@ async def add_track_to_playlist(
             db.rollback()
             raise HTTPException(status_code=400, detail=str(e))
 
-    return db_track
+    return json_response(db_track.to_dict())
 
 @router.get("/playlists/{playlist_id}/tracks", response_model=List[TrackResponse])
-async def get_playlist_tracks(playlist_id: str, db: Session = Depends(get_db)):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-    if not playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
-    return playlist.tracks
+async def get_playlist_tracks(playlist_id: str, request: Request, db: Session = Depends(get_db)):
+    playlist = _brand_playlist(db, playlist_id)
+    return etag_json_response(request, [track.to_dict() for track in playlist.tracks])
 
 @router.delete("/playlists/{playlist_id}/tracks/{track_id}")
 async def remove_track_from_playlist(
@@ -178,9 +307,7 @@ async def remove_track_from_playlist(
     track_id: str,
     db: Session = Depends(get_db)
 ):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-    if not playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
+    playlist = _brand_playlist(db, playlist_id)
 
     track = db.query(Track).filter(Track.id == track_id).first()
     if not track:
@@ -203,9 +330,7 @@ async def reorder_playlist_tracks(
     track_positions: List[Dict[str, int]],  # List of {track_id: position}
     db: Session = Depends(get_db)
 ):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
-    if not playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
+    playlist = _brand_playlist(db, playlist_id)
 
     try:
         # Update track positions in the association table
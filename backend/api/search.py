@@ -1,22 +1,32 @@
-from fastapi import APIRouter, HTTPException, Header, Depends
+from fastapi import APIRouter, HTTPException, Header, Depends, Query
+from sqlalchemy.orm import Session
 from typing import Optional, Dict, List
-import httpx
-from .auth import validate_token_string
+from .auth import spotify_token, verified_spotify_token, verify_token
+from .. import spotify_client, typeahead
+from ..cache import get_cache
+from ..config import SEARCH_CACHE_TTL, SESSION_HEADER
+from ..database import get_db
 
 router = APIRouter()
+search_cache = get_cache("search", default_ttl=SEARCH_CACHE_TTL)
 
 SPOTIFY_API_BASE = "https://api.spotify.com/v1"
 
-@router.get("/tracks", response_model=Dict[str, List[dict]])
-async def search_tracks(
-    q: str,
-    token: str = Depends(validate_token_string)
-):
+async def fetch_tracks(q: str, token: str) -> List[dict]:
+    """Spotify track search for a query, cached per normalized query; callers verify the token first"""
+    import httpx
+
+    cached = await search_cache.aget(q.strip().lower())
+    if cached is not None:
+        return cached
+
     try:
         # Create async HTTP client
         async with httpx.AsyncClient() as client:
             # Make request to Spotify search API
-            response = await client.get(
+            response = await spotify_client.request(
+                client,
+                "GET",
                 f"{SPOTIFY_API_BASE}/search",
                 params={
                     "q": q,
@@ -49,7 +59,8 @@ async def search_tracks(
                 }
                 formatted_tracks.append(formatted_track)
 
-            return {"tracks": formatted_tracks}
+            await search_cache.aset(q.strip().lower(), formatted_tracks)
+            return formatted_tracks
 
     except httpx.HTTPStatusError as e:
         error_detail = "Failed to search tracks"
@@ -70,4 +81,33 @@ async def search_tracks(
         raise HTTPException(
             status_code=500,
             detail=str(e)
-        )
\ No newline at end of file
+        )
+
+@router.get("/tracks", response_model=Dict[str, List[dict]])
+async def search_tracks(
+    q: str,
+    token: str = Depends(verified_spotify_token)
+):
+    return {"tracks": await fetch_tracks(q, token)}
+
+@router.get("/suggest")
+async def suggest(
+    q: str,
+    limit: int = Query(10, ge=1, le=50),
+    full: bool = False,
+    x_session_id: Optional[str] = Header(None, alias=SESSION_HEADER),
+    authorization: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Typeahead over known tracks and library genres, answered from the
+    in-process index. Call it on every keystroke; only a full (debounced)
+    query with fewer than `limit` local matches goes on to Spotify, so the
+    Spotify token is required just for those.
+    """
+    suggestions = (await typeahead.get_index()).search(q, limit)
+    tracks = []
+    if full and len(suggestions) < limit:
+        token = await verify_token(await spotify_token(x_session_id, authorization, db))
+        tracks = await fetch_tracks(q, token)
+    return {"suggestions": suggestions, "tracks": tracks}
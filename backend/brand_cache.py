@@ -0,0 +1,57 @@
+"""
+In-process read-through cache of brand profiles.
+
+Brands are read far more often than written, so each worker keeps recent
+profiles as read-only snapshots, with the profile JSON already serialized
+for responses. Entries are bounded by their serialized size
+(BRAND_CACHE_MAX_BYTES) and expire after BRAND_CACHE_TTL.
+
+A write bumps the brand's stamp in the shared cache, and every read checks
+the stamp its snapshot was loaded under, so an approve or delete through any
+worker is seen by all of them on their next read. The version column on
+brand_profiles still keeps concurrent writes from overwriting newer data.
+"""
+import uuid
+from typing import Any, Dict, Optional
+
+from .cache import LRUCache, get_cache
+from .config import BRAND_CACHE_MAX_BYTES, BRAND_CACHE_TTL
+from .models import BrandProfile
+from .responses import dumps
+
+class CachedBrand:
+    """Read-only snapshot of a brand row; never mutate `data`"""
+
+    __slots__ = ("id", "name", "data", "version", "body", "stamp")
+
+    def __init__(self, brand: BrandProfile, stamp: Optional[str] = None):
+        self.id = brand.id
+        self.name = brand.name
+        self.data: Dict[str, Any] = brand.data
+        self.version = brand.version
+        # Sorted keys, as used for ETag responses
+        self.body = dumps(brand.data, sort_keys=True)
+        self.stamp = stamp
+
+_brands = LRUCache("brand_profiles", default_ttl=BRAND_CACHE_TTL, max_size=BRAND_CACHE_MAX_BYTES, sizeof=lambda brand: len(brand.body))
+# Changed on every write, in the cache all workers share
+_stamps = get_cache("brand_stamps")
+
+async def get_brand(db, brand_id: str) -> Optional[CachedBrand]:
+    """Brand snapshot from the cache, loading it from the database on a miss or after a write anywhere"""
+    # Read before the row, so a write landing in between leaves the snapshot marked stale
+    stamp = await _stamps.aget(brand_id)
+    brand = _brands.get(brand_id)
+    if brand is None or brand.stamp != stamp:
+        row = db.query(BrandProfile).filter(BrandProfile.id == brand_id).first()
+        if row is None:
+            _brands.delete(brand_id)
+            return None
+        brand = CachedBrand(row, stamp)
+        _brands.set(brand_id, brand)
+    return brand
+
+async def invalidate(brand_id: str):
+    """Call after committing a write to the brand"""
+    _brands.delete(brand_id)
+    await _stamps.aset(brand_id, uuid.uuid4().hex)
@@ -0,0 +1,99 @@
+"""
+Full-text index over brand profiles (FTS5 on SQLite, tsvector on PostgreSQL).
+
+ORM events on BrandProfile keep it in step with every write.
+"""
+import logging
+import re
+from typing import List, Tuple
+
+from sqlalchemy import event, text
+
+from .database import SessionLocal
+from .library import profile_text
+from .models import BrandProfile
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def _is_postgres(connection) -> bool:
+    return connection.dialect.name == "postgresql"
+
+def ensure_search_index():
+    """Create the index if missing and rebuild it when it is out of step with brand_profiles"""
+    db = SessionLocal()
+    try:
+        connection = db.connection()
+        if _is_postgres(connection):
+            connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS brand_search (brand_id VARCHAR PRIMARY KEY, document TSVECTOR NOT NULL)"
+            ))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_brand_search_document ON brand_search USING GIN (document)"
+            ))
+        else:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS brand_search "
+                "USING fts5(brand_id UNINDEXED, name, content, tokenize='porter unicode61')"
+            ))
+
+        indexed = connection.execute(text("SELECT count(*) FROM brand_search")).scalar()
+        brands = db.query(BrandProfile.id, BrandProfile.name, BrandProfile.data).all()
+        if indexed != len(brands):
+            connection.execute(text("DELETE FROM brand_search"))
+            for brand_id, name, data in brands:
+                _index(connection, brand_id, name, data)
+            logger.info(f"Rebuilt brand search index with {len(brands)} brands")
+        db.commit()
+    finally:
+        db.close()
+
+def _index(connection, brand_id: str, name: str, data: dict):
+    params = {"brand_id": brand_id, "name": name, "content": profile_text(data or {})}
+    if _is_postgres(connection):
+        connection.execute(text(
+            "INSERT INTO brand_search (brand_id, document) VALUES (:brand_id, "
+            "setweight(to_tsvector('english', :name), 'A') || setweight(to_tsvector('english', :content), 'B')) "
+            "ON CONFLICT (brand_id) DO UPDATE SET document = EXCLUDED.document"
+        ), params)
+    else:
+        connection.execute(text("DELETE FROM brand_search WHERE brand_id = :brand_id"), params)
+        connection.execute(text(
+            "INSERT INTO brand_search (brand_id, name, content) VALUES (:brand_id, :name, :content)"
+        ), params)
+
+@event.listens_for(BrandProfile, "after_insert")
+@event.listens_for(BrandProfile, "after_update")
+def _index_brand(mapper, connection, brand):
+    _index(connection, brand.id, brand.name, brand.data)
+
+@event.listens_for(BrandProfile, "after_delete")
+def _unindex_brand(mapper, connection, brand):
+    connection.execute(text("DELETE FROM brand_search WHERE brand_id = :brand_id"), {"brand_id": brand.id})
+
+def search_brands(db, query: str, limit: int, offset: int) -> Tuple[List[Tuple[str, float]], int]:
+    """(brand_id, score) pairs for one page, best first, and the total number of matches"""
+    connection = db.connection()
+    if _is_postgres(connection):
+        match = "FROM brand_search, websearch_to_tsquery('english', :q) query WHERE document @@ query"
+        score = "ts_rank(document, query)"
+        params = {"q": query}
+    else:
+        # Quote every word so user input can't be read as FTS5 query syntax; words are ANDed
+        words = _TOKEN_PATTERN.findall(query)
+        if not words:
+            return [], 0
+        match = "FROM brand_search WHERE brand_search MATCH :q"
+        # bm25 is lower for better matches; the name column counts ten times the rest
+        score = "-bm25(brand_search, 0.0, 10.0, 1.0)"
+        params = {"q": " ".join(f'"{word}"' for word in words)}
+
+    total = db.execute(text(f"SELECT count(*) {match}"), params).scalar()
+    if not total or offset >= total:
+        return [], total or 0
+    rows = db.execute(
+        text(f"SELECT brand_id, {score} AS score {match} ORDER BY score DESC, brand_id LIMIT :limit OFFSET :offset"),
+        {**params, "limit": limit, "offset": offset}
+    ).all()
+    return [(brand_id, float(score)) for brand_id, score in rows], total
@@ -0,0 +1,291 @@
+"""
+Key/value caches shared by the API routers.
+
+All caches implement the same small interface. The SQLite backend stores
+entries in one file opened by every worker process, so cached tokens, search
+results and track resolutions are shared across workers and survive
+restarts. The memory backend is per-process and meant for local development.
+
+Async code uses the `aget`/`aset`/`aadd`/`adelete` variants, which run the
+SQLite backend's file I/O in a worker thread instead of on the event loop.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .config import CACHE_BACKEND, CACHE_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class Cache(ABC):
+    """Interface for namespaced caches with per-entry TTL"""
+
+    def __init__(self, namespace: str, default_ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set only if the key holds no live entry; True when this call stored the value"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    # In-process backends answer without blocking, so the async variants call straight through
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return self.get(key, default)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set(key, value, ttl)
+
+    async def aadd(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        return self.add(key, value, ttl)
+
+    async def adelete(self, key: str) -> None:
+        self.delete(key)
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+class MemoryCache(Cache):
+    """Per-process cache backed by a dict"""
+
+    def __init__(self, namespace: str, default_ttl: Optional[float] = None):
+        super().__init__(namespace, default_ttl)
+        self._entries: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            value, expires_at = self._entries.get(key, (_MISSING, None))
+            if value is _MISSING:
+                return default
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._entries[key] = (value, self._expires_at(ttl))
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            _, expires_at = self._entries.get(key, (_MISSING, 0))
+            if key in self._entries and (expires_at is None or expires_at >= time.time()):
+                return False
+            self._entries[key] = (value, self._expires_at(ttl))
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class LRUCache(Cache):
+    """
+    Per-process cache holding at most max_size, as measured by sizeof (one
+    per entry by default), evicting the least recently used entries first
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        default_ttl: Optional[float] = None,
+        max_size: int = 1024,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        super().__init__(namespace, default_ttl)
+        self.max_size = max_size
+        self._sizeof = sizeof or (lambda value: 1)
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[float], int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, expires_at, _ = self._entries[key]
+            if expires_at is not None and expires_at < time.time():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, self._expires_at(ttl), size)
+            self._size += size
+            while self._size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        if self.get(key, _MISSING) is not _MISSING:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+class SQLiteCache(Cache):
+    """Cache stored in a SQLite file shared by all worker processes"""
+
+    # Purge expired rows roughly once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, namespace: str, default_ttl: Optional[float] = None, path: str = CACHE_DB_PATH):
+        super().__init__(namespace, default_ttl)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process; reopen after a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read failed for {self.namespace}: {str(e)}")
+            return default
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return default
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), self._expires_at(ttl))
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write failed for {self.namespace}: {str(e)}")
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        try:
+            # Insert, or take over an expired entry, atomically across processes
+            cursor = self._connection().execute(
+                "INSERT INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE cache_entries.expires_at < ?",
+                (self.namespace, key, json.dumps(value), self._expires_at(ttl), time.time())
+            )
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            # Without the cache, let the caller go ahead rather than block it
+            logger.warning(f"Cache add failed for {self.namespace}: {str(e)}")
+            return True
+
+    def delete(self, key: str) -> None:
+        try:
+            self._connection().execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Cache delete failed for {self.namespace}: {str(e)}")
+
+    def clear(self) -> None:
+        try:
+            self._connection().execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            logger.warning(f"Cache clear failed for {self.namespace}: {str(e)}")
+
+    # File access (and waiting on another process's write lock) stays off the event loop
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def aadd(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        return await asyncio.to_thread(self.add, key, value, ttl)
+
+    async def adelete(self, key: str) -> None:
+        await asyncio.to_thread(self.delete, key)
+
+_caches: Dict[str, Cache] = {}
+
+def get_cache(namespace: str, default_ttl: Optional[float] = None) -> Cache:
+    """Get the cache for a namespace using the configured backend"""
+    if namespace not in _caches:
+        if CACHE_BACKEND == "sqlite":
+            _caches[namespace] = SQLiteCache(namespace, default_ttl)
+        else:
+            _caches[namespace] = MemoryCache(namespace, default_ttl)
+    return _caches[namespace]
+
+def cache_key(*parts: str) -> str:
+    """Build a fixed-length key; also keeps secrets such as tokens out of the cache file"""
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
@@ -1,8 +1,10 @@
 import os
-from dotenv import load_dotenv
+import json
 from pathlib import Path
 
-# Load environment variables
+from dotenv import load_dotenv
+
+# Before any os.getenv below (and in database.py), so settings from a local .env take effect
 load_dotenv()
 
 # Spotify API Configuration
@@ -30,20 +32,152 @@ SPOTIFY_SCOPES = [
 
 # API Configuration
 API_PREFIX = "/api"
-DEBUG = True
+DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 
 # Cache Configuration
 CACHE_PATH = None  # Disable file caching to prevent token persistence issues
 CACHE_HANDLER = None  # Use in-memory caching
 
+# Application cache shared by all worker processes ("sqlite") or per process ("memory")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", str(Path(__file__).parent / "cache" / "app_cache.sqlite3"))
+TOKEN_CACHE_TTL = 300  # seconds; access token -> Spotify user profile
+SEARCH_CACHE_TTL = 600  # seconds; search query -> formatted tracks
+TYPEAHEAD_PREFIX_LENGTH = 4  # word prefixes indexed for /search/suggest; longer ones are checked per entry
+TYPEAHEAD_REBUILD_INTERVAL = 600  # seconds; picks up tracks inserted by other workers
+RESOLUTION_CACHE_TTL = 24 * 3600  # seconds; (track, artist) -> Spotify match
+# Per-process brand profile cache; the TTL bounds how long other workers may serve a profile after a write
+BRAND_CACHE_TTL = 60  # seconds
+BRAND_CACHE_MAX_BYTES = int(os.getenv("BRAND_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))  # serialized profile bytes
+
 # Request Configuration
 REQUEST_TIMEOUT = 30  # seconds
 MAX_RETRIES = 3
 RETRY_DELAY = 0.1  # seconds
 
+# Spotify Rate Limiting (per worker process)
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "10"))  # calls per second
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", "20"))
+SPOTIFY_BACKOFF_BASE = 0.5  # seconds, doubled per retry
+SPOTIFY_BACKOFF_MAX = 30  # seconds
+PLAYLIST_READ_CONCURRENCY = int(os.getenv("PLAYLIST_READ_CONCURRENCY", "10"))  # pages of one playlist fetched at once
+PLAYLIST_MIRROR_MAX_AGE = 15 * 60  # seconds before a mirrored playlist listing counts as stale
+PLAYLIST_MIRROR_CONCURRENCY = 4  # playlists whose items are re-read at once while mirroring
+PLAYLIST_MIRROR_SYNC_TTL = 10 * 60  # seconds a mirror run may hold its per-user claim
+TRACK_HYDRATION_BATCH = 50  # IDs per call to Spotify's multi-track endpoint (its maximum)
+TRACK_HYDRATION_CONCURRENCY = 4  # track batches fetched at once
+TRACK_HYDRATION_LIMIT = 10000  # tracks hydrated per pass
+TRACK_REFRESH_AGE = 7 * 24 * 3600  # seconds before stored track metadata (e.g. preview URLs) is refreshed
+
+# Track Matching Configuration
+SEARCH_CANDIDATES = 5  # Spotify results scored locally per suggestion
+MATCH_THRESHOLD = 0.6  # minimum score (0-1) for a candidate to count as the suggested song
+MATCH_MIN_ARTIST_SCORE = 0.5  # minimum artist similarity too, so a title alone never makes a match
+LOW_CONFIDENCE_THRESHOLD = 0.85  # matches scoring below this are listed for review
+
+# LLM Configuration
+LLM_MODEL = "claude-2"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # seconds, per call deadline
+LLM_FAILURE_THRESHOLD = 3  # consecutive failures before the circuit opens
+LLM_RESET_TIMEOUT = 60  # seconds the circuit stays open before a trial call
+SUGGESTION_CACHE_TTL = 7 * 24 * 3600  # seconds; last good suggestions per brand
+SUGGESTION_TOPUP_ROUNDS = 2  # LLM rounds replacing songs not found on Spotify
+TOPUP_TOKENS_PER_SONG = 120  # max_tokens per requested replacement song
+PLAYLIST_FLIGHT_TTL = 10 * 60  # seconds a create-playlist run may hold its (user, brand) claim
+PLAYLIST_REPLAY_TTL = 60  # seconds a finished run's result is handed to repeated requests
+IDEMPOTENCY_TTL = 24 * 3600  # seconds results are kept per Idempotency-Key
+BRAND_BATCH_CONCURRENCY = int(os.getenv("BRAND_BATCH_CONCURRENCY", "5"))  # parallel profile generations
+LIBRARY_PATH = str(Path(__file__).parent / "data" / "hitcraft_library.json")
+
+# Admission Control Configuration (per worker process)
+# Expensive route classes: concurrent requests, extra requests allowed to wait, requests per caller per window
+ADMISSION_LIMITS = {
+    "brand-profile": {"concurrency": 4, "queue": 8, "per_user": 10},
+    "suggest-music": {"concurrency": 4, "queue": 8, "per_user": 20},
+    "create-playlist": {"concurrency": 4, "queue": 8, "per_user": 10},
+}
+ADMISSION_LIMITS.update(json.loads(os.getenv("ADMISSION_LIMITS", "{}")))
+ADMISSION_QUEUE_TIMEOUT = 10  # seconds a queued request waits for a slot before a 503
+ADMISSION_RETRY_AFTER = 5  # seconds, sent with 503 responses
+USER_QUOTA_WINDOW = 60  # seconds
+# Proxies in front of the app that append to X-Forwarded-For (Heroku's router: one); 0 trusts no header
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1" if os.getenv("DYNO") else "0"))
+
+# Background Playlist Refresh Configuration
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_INTERVAL = int(os.getenv("SCHEDULER_INTERVAL", str(6 * 3600)))  # seconds between refreshes of a playlist
+SCHEDULER_LOCK_TTL = 15 * 60  # seconds a worker may hold a claimed refresh
+
+# Server-side Token Store Configuration
+# Tokens are encrypted with TOKEN_ENCRYPTION_KEY (a Fernet key), read from the environment on first use
+SESSION_HEADER = "X-Session-ID"
+TOKEN_REFRESH_MARGIN = 5 * 60  # seconds before expiry at which an access token is refreshed
+TOKEN_REFRESH_INTERVAL = 60  # seconds between background scans for expiring tokens
+SESSION_ACTIVE_WINDOW = 24 * 3600  # seconds since last use during which a session is refreshed in the background
+SESSION_MAX_IDLE = 30 * 24 * 3600  # seconds after which an unused session is deleted
+
+# Response Compression Configuration
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))  # bytes
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/manifest+json",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+# Static Frontend Configuration
+STATIC_DIR = os.getenv("STATIC_DIR", str(Path(__file__).parent / "static"))
+STATIC_URL_PREFIX = "/static"
+# Browser navigations get index.html only on paths no API route matches, and on
+# these client-side routes, which share their path with an API route
+SPA_ROUTES = ("/", "/brands")
+STATIC_PRECOMPRESS_EXTENSIONS = {".css", ".html", ".js", ".json", ".map", ".svg", ".txt"}
+BROTLI_STATIC_QUALITY = 11  # precompressed once, so use the densest setting
+
+# Query Budget Configuration
+# Maximum SQL statements a single request may issue before it is logged,
+# keyed by "METHOD /route/path". Routes not listed use QUERY_BUDGET_DEFAULT.
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", "10"))
+QUERY_BUDGETS = {
+    "GET /brands": 2,
+    "GET /brands/search": 3,
+    "GET /brands/{brand_id}": 2,
+    "PUT /brands/{brand_id}": 4,
+    "DELETE /brands/{brand_id}": 5,
+    "POST /brands/{brand_id}/approve": 4,
+    "POST /brands/create-playlist": 9,
+    "GET /search/suggest": 3,
+    "GET /playlist/user": 3,
+    "GET /playlist/user/{spotify_playlist_id}/tracks": 3,
+    "GET /playlist/playlists/": 1,
+    "GET /playlist/playlists/{playlist_id}": 1,
+    "GET /playlist/playlists/{playlist_id}/tracks": 2,
+    "POST /playlist/playlists/{playlist_id}/tracks": 6,
+}
+QUERY_BUDGETS.update(json.loads(os.getenv("QUERY_BUDGETS", "{}")))
+# Expose the per-request statement count as an X-Query-Count response header (tests and local debugging)
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", str(DEBUG)).lower() == "true"
+
 # Logging Configuration
-LOG_LEVEL = "INFO"
-LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"  # used when LOG_JSON is off
+LOG_JSON = os.getenv("LOG_JSON", "true").lower() == "true"
+LOG_MAX_MESSAGE_CHARS = 2000  # longer messages and tracebacks are truncated
+# INFO/DEBUG messages longer than this are sampled at LOG_SAMPLE_RATE; warnings and errors never are
+LOG_SAMPLE_THRESHOLD = 500
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+# Startup Configuration
+# Budget for `python -X importtime -c "import backend.main"`, enforced by benchmarks/import_time.py
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "1000"))
+# SDKs that must only be imported on first use, never while importing the app
+LAZY_IMPORTS = ["anthropic", "spotipy", "cryptography"]
 
 # Create necessary directories
 def ensure_directories():
@@ -56,7 +190,4 @@ def ensure_directories():
     base_path = Path(__file__).parent
     for directory in directories:
         path = base_path / directory
-        path.mkdir(exist_ok=True)
-
-# Initialize directories
-ensure_directories()
\ No newline at end of file
+        path.mkdir(exist_ok=True)
\ No newline at end of file
@@ -1,9 +1,12 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 import logging
 
+from .query_budget import install_query_counter
+
 logger = logging.getLogger(__name__)
 
 # Get database URL from environment variable or use SQLite for local development
@@ -21,6 +24,9 @@ except Exception as e:
     logger.error(f"Error creating database engine: {str(e)}")
     raise
 
+# Count statements per request so routes exceeding their query budget get logged
+install_query_counter(engine)
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -35,11 +41,16 @@ def init_db():
     """Initialize database, creating tables if they don't exist"""
     try:
         # Import all models to ensure they're registered with Base
-        from .models import BrandProfile, Playlist, Track
+        from .models import BrandProfile, Playlist, Track, SpotifyAccount, PlaylistSync, AuthSession, BrandSuggestion
         
         # Create tables
         Base.metadata.create_all(bind=engine)
         logger.info("Database tables created successfully")
+        _add_missing_columns()
+        # Before any brand writes below, whose ORM events update the search index
+        from .brand_search import ensure_search_index
+        ensure_search_index()
+        _migrate_suggested_songs()
         
         # If running locally and no brands exist, create Gucci template
         if DATABASE_URL.startswith("sqlite"):
@@ -146,6 +157,54 @@ def init_db():
         logger.error(f"Error initializing database: {str(e)}")
         raise
 
+def _add_missing_columns():
+    """Add model columns missing from existing tables, which create_all does not alter"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            try:
+                # One transaction per column: a failed ALTER aborts the whole transaction on PostgreSQL
+                with engine.begin() as connection:
+                    connection.execute(text(ddl))
+                logger.info(f"Added column {table.name}.{column.name}")
+            except DBAPIError as e:
+                # Every worker runs this at boot; another one may have just added the column
+                message = str(e.orig).lower()
+                if "duplicate column" not in message and "already exists" not in message:
+                    raise
+                logger.info(f"Column {table.name}.{column.name} was added by another worker")
+
+def _migrate_suggested_songs():
+    """Move suggestions saved in BrandProfile.data["suggested_songs"] into brand_suggestions rows"""
+    from .models import BrandProfile
+    from .playlist_builder import store_suggestions
+
+    session = SessionLocal()
+    try:
+        migrated = 0
+        for brand in session.query(BrandProfile).all():
+            if "suggested_songs" not in brand.data:
+                continue
+            store_suggestions(session, brand.id, brand.data["suggested_songs"])
+            brand.data = {key: value for key, value in brand.data.items() if key != "suggested_songs"}
+            migrated += 1
+        session.commit()
+        if migrated:
+            logger.info(f"Moved suggested songs of {migrated} brands into brand_suggestions")
+    except Exception as e:
+        logger.error(f"Error migrating suggested songs: {str(e)}")
+        session.rollback()
+    finally:
+        session.close()
+
 def get_db():
     """Get database session"""
     db = SessionLocal()
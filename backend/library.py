@@ -0,0 +1,64 @@
+"""
+HitCraft music library (backend/data/hitcraft_library.json).
+
+Used as a local source of genre recommendations when the LLM is unavailable.
+"""
+import json
+import re
+from functools import lru_cache
+from typing import Dict, List
+
+from .config import LIBRARY_PATH
+
+_WORD_PATTERN = re.compile(r"[a-z]{4,}")
+# Frequent words in genre descriptions that say nothing about fit
+_STOPWORDS = {
+    "also", "brand", "elements", "from", "genre", "into", "known", "music", "often",
+    "sound", "style", "that", "their", "these", "this", "with", "while",
+}
+
+@lru_cache(maxsize=1)
+def load_library() -> Dict:
+    """Load and memoize the library file"""
+    with open(LIBRARY_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def _words(text: str) -> set:
+    return set(_WORD_PATTERN.findall(text.lower())) - _STOPWORDS
+
+def profile_text(brand_profile: Dict) -> str:
+    """All text values of a brand profile joined together, without status and saved songs"""
+    parts = []
+
+    def collect(value):
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+        elif isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+
+    collect({key: value for key, value in brand_profile.items() if key not in ("status", "suggested_songs")})
+    return " ".join(parts)
+
+def match_genres(brand_profile: Dict, limit: int = 5) -> List[Dict]:
+    """Rank library genres by word overlap with the brand profile text"""
+    profile_words = _words(profile_text(brand_profile))
+    scored = []
+    for genre in load_library().get("genres", []):
+        genre_words = _words(f"{genre['name']} {genre.get('category', '')} {genre.get('description', '')}")
+        score = len(profile_words & genre_words)
+        if score:
+            scored.append((score, genre))
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [
+        {
+            "name": genre["name"],
+            "category": genre.get("category"),
+            "description": genre.get("description"),
+            "score": score
+        }
+        for score, genre in scored[:limit]
+    ]
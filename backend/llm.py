@@ -0,0 +1,113 @@
+"""
+Claude completions behind a circuit breaker.
+
+Each call gets a hard deadline, enforced by the HTTP client. After LLM_FAILURE_THRESHOLD consecutive
+failures the circuit opens and calls fail immediately with
+LLMUnavailableError for LLM_RESET_TIMEOUT seconds; then one trial call is
+let through to probe whether the API has recovered. Callers catch
+LLMUnavailableError and fall back to cached or locally derived results.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from .config import LLM_FAILURE_THRESHOLD, LLM_MODEL, LLM_RESET_TIMEOUT, LLM_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class LLMUnavailableError(Exception):
+    """The LLM call failed, timed out or was rejected by an open circuit"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial call"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"LLM circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+llm_breaker = CircuitBreaker(LLM_FAILURE_THRESHOLD, LLM_RESET_TIMEOUT)
+
+_client = None
+
+def _get_client():
+    global _client
+    from anthropic import Anthropic
+
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        logger.error("ANTHROPIC_API_KEY not found in environment variables")
+        raise ValueError("ANTHROPIC_API_KEY not set")
+    if _client is None:
+        # Retrying inside the deadline would only hide a failing API
+        _client = Anthropic(api_key=api_key.strip(), timeout=LLM_TIMEOUT, max_retries=0)
+    return _client
+
+async def complete(user_prompt: str, max_tokens: int, timeout: float = LLM_TIMEOUT) -> str:
+    """Send a prompt to Claude and return the completion text"""
+    if not llm_breaker.allow():
+        raise LLMUnavailableError("LLM circuit is open")
+
+    try:
+        # Inside the try: a missing key or package is a failure like any other, which
+        # also ends a half-open trial instead of leaving it in flight
+        from anthropic import HUMAN_PROMPT, AI_PROMPT, APITimeoutError
+
+        client = _get_client()
+    except Exception as e:
+        llm_breaker.record_failure()
+        raise LLMUnavailableError(f"LLM call failed: {str(e)}") from e
+
+    try:
+        # The deadline is the HTTP client's, so the worker thread ends with the request
+        # instead of running on after an asyncio-side timeout
+        response = await asyncio.to_thread(
+            client.completions.create,
+            model=LLM_MODEL,
+            prompt=f"{HUMAN_PROMPT}{user_prompt}{AI_PROMPT}",
+            max_tokens_to_sample=max_tokens,
+            stop_sequences=[HUMAN_PROMPT],
+            timeout=timeout
+        )
+    except APITimeoutError as e:
+        llm_breaker.record_failure()
+        raise LLMUnavailableError(f"LLM call exceeded {timeout}s deadline") from e
+    except Exception as e:
+        llm_breaker.record_failure()
+        raise LLMUnavailableError(f"LLM call failed: {str(e)}") from e
+
+    llm_breaker.record_success()
+    return response.completion
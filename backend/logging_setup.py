@@ -0,0 +1,95 @@
+"""
+Process-wide logging configuration.
+
+Records are capped and sampled, then queued to a listener thread that writes
+them (as JSON lines by default), so logging never blocks the event loop.
+"""
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from .config import (
+    LOG_FORMAT, LOG_JSON, LOG_LEVEL, LOG_MAX_MESSAGE_CHARS, LOG_SAMPLE_RATE, LOG_SAMPLE_THRESHOLD,
+)
+
+_listener: Optional[QueueListener] = None
+
+def _cap(text: str, limit: int = LOG_MAX_MESSAGE_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if getattr(record, "sampled", False):
+            entry["sample_rate"] = LOG_SAMPLE_RATE
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Let through only a share of long INFO/DEBUG records"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if len(str(record.msg)) + sum(len(str(arg)) for arg in (record.args or ())) <= LOG_SAMPLE_THRESHOLD:
+            return True
+        record.sampled = True
+        return random.random() < LOG_SAMPLE_RATE
+
+class CappedQueueHandler(QueueHandler):
+    """Queue records with the message and traceback already rendered and size-capped"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = _cap(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _cap("".join(traceback.format_exception(*record.exc_info)).rstrip())
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+def configure_logging(level: str = LOG_LEVEL):
+    """Route all logging through the queue; calling it again has no effect"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    handler = CappedQueueHandler(records)
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(records, stream)
+    _listener.start()
+
+def shutdown_logging():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,13 +1,39 @@
 # backend/main.py
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 
-logging.basicConfig(level=logging.INFO)
+from backend.compression import CompressionMiddleware
+from backend.config import SCHEDULER_ENABLED, ensure_directories
+from backend.database import init_db
+from backend.logging_setup import configure_logging, shutdown_logging
+from backend.query_budget import QueryBudgetMiddleware
+from backend.scheduler import run_scheduler
+from backend.token_store import run_token_refresher
+from backend.static_files import StaticFilesMiddleware, precompress_static
+
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run process-wide side effects once at startup instead of at import time"""
+    configure_logging()
+    ensure_directories()
+    init_db()
+    precompress_static()
+    background = [asyncio.create_task(run_token_refresher())]
+    if SCHEDULER_ENABLED:
+        background.append(asyncio.create_task(run_scheduler()))
+    logger.info("Application startup complete")
+    yield
+    for task in background:
+        task.cancel()
+    shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 origins = [
@@ -26,6 +52,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Serve the built frontend from backend/static with SPA fallback
+app.add_middleware(StaticFilesMiddleware)
+
+# Compress larger responses (brotli or gzip, by Accept-Encoding)
+app.add_middleware(CompressionMiddleware)
+
+# Count SQL statements per request and log routes that exceed their budget
+app.add_middleware(QueryBudgetMiddleware)
+
 # Import routers
 try:
     from backend.api import auth_router, playlist_router, search_router, brands_router
@@ -0,0 +1,90 @@
+"""
+Local scoring of Spotify search candidates against a suggested song.
+
+Titles and artists are normalized (case, accents, punctuation, "feat."
+credits, remaster/version suffixes) and compared with difflib, so one
+relaxed search returning a few candidates replaces strict
+`track:X artist:Y` queries that miss on small spelling differences. A
+candidate must match on the artist as well as the title: a cover or
+namesake by someone else is not the suggested song.
+"""
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from .config import MATCH_MIN_ARTIST_SCORE, MATCH_THRESHOLD
+
+TITLE_WEIGHT = 0.6
+ARTIST_WEIGHT = 0.4
+
+# "Song (with B)", "Song feat. B"; a bare "with" is part of titles like "Stay With Me"
+_FEATURING = re.compile(r"\s*(?:[\(\[]\s*(?:feat|ft|featuring|with)|\b(?:feat|ft|featuring))\b\.?.*$")
+_VERSION = re.compile(r"\s*([\(\[][^\)\]]*[\)\]]|\s-\s.*)$")
+_ARTIST_SEPARATORS = re.compile(r"\s*(?:,|&|\band\b|\bx\b|\bvs\b\.?|/)\s*")
+_APOSTROPHES = re.compile(r"['\u2019`]")
+_NON_WORD = re.compile(r"[^\w\s]")
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in text if not unicodedata.combining(char)).lower().replace("&", " and ")
+
+def _clean(text: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", _APOSTROPHES.sub("", text)).split())
+
+def normalize_title(title: str) -> str:
+    """Comparable form of a track title, without credits or version suffixes"""
+    title = _FEATURING.sub("", _fold(title))
+    # "Song (Remastered 2011)", "Song - Radio Edit"
+    stripped = _VERSION.sub("", title)
+    return _clean(stripped or title)
+
+def split_artists(artist: str) -> List[str]:
+    """Normalized individual names from a credit like "A feat. B & C" """
+    folded = _fold(artist).replace(" and ", " & ")
+    folded = re.sub(r"\b(feat|ft|featuring|with)\b\.?", ",", folded)
+    return [name for name in (_clean(part) for part in _ARTIST_SEPARATORS.split(folded)) if name]
+
+def similarity(a: str, b: str, containment: bool = False) -> float:
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    ratio = SequenceMatcher(None, a, b).ratio()
+    # One title contained in the other as whole words, e.g. a subtitle dropped
+    if containment and (f" {a} " in f" {b} " or f" {b} " in f" {a} "):
+        ratio = max(ratio, 0.9)
+    return ratio
+
+def score_parts(track: str, artist: str, candidate: Dict) -> Tuple[float, float]:
+    """0-1 title and artist similarity of a Spotify track object to the suggested track and artist"""
+    title_score = similarity(normalize_title(track), normalize_title(candidate.get('name', '')), containment=True)
+    wanted = split_artists(artist)
+    credited = [name for credit in candidate.get('artists', []) for name in split_artists(credit.get('name', ''))]
+    artist_score = max((similarity(a, b) for a in wanted for b in credited), default=0.0)
+    return title_score, artist_score
+
+def score_candidate(track: str, artist: str, candidate: Dict) -> float:
+    """0-1 match score of a Spotify track object for the suggested track and artist"""
+    title_score, artist_score = score_parts(track, artist, candidate)
+    return TITLE_WEIGHT * title_score + ARTIST_WEIGHT * artist_score
+
+def search_query(track: str, artist: str) -> str:
+    """Relaxed free-text query: cleaned title plus the main artist"""
+    artists = split_artists(artist)
+    return f"{normalize_title(track) or track} {artists[0] if artists else artist}"
+
+def best_match(track: str, artist: str, candidates: List[Dict]) -> Tuple[Optional[Dict], float]:
+    """Highest scoring candidate at or above MATCH_THRESHOLD (and MATCH_MIN_ARTIST_SCORE), with its score"""
+    best, best_score, top_score = None, 0.0, 0.0
+    for candidate in candidates:
+        if not candidate:
+            continue
+        title_score, artist_score = score_parts(track, artist, candidate)
+        score = TITLE_WEIGHT * title_score + ARTIST_WEIGHT * artist_score
+        top_score = max(top_score, score)
+        if artist_score >= MATCH_MIN_ARTIST_SCORE and score > best_score:
+            best, best_score = candidate, score
+    if best is None or best_score < MATCH_THRESHOLD:
+        return None, top_score
+    return best, best_score
@@ -1,10 +1,9 @@
-from sqlalchemy import Column, String, JSON, Integer, ForeignKey, DateTime, Table
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, String, JSON, Integer, Float, ForeignKey, DateTime, Table, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
 
-Base = declarative_base()
+from .database import Base
 
 class BrandProfile(Base):
     __tablename__ = "brand_profiles"
@@ -12,6 +11,10 @@ class BrandProfile(Base):
     id = Column(String, primary_key=True)  # brand_id (e.g., "gucci", "nike")
     name = Column(String, nullable=False)   # Brand name
     data = Column(JSON, nullable=False)     # Full brand profile as JSON
+    version = Column(Integer, nullable=False, server_default="1")  # bumped on every write
+
+    # UPDATE/DELETE only match the version that was read, so racing writers fail with StaleDataError
+    __mapper_args__ = {"version_id_col": version}
 
     def to_dict(self):
         return {
@@ -36,6 +39,24 @@ playlist_tracks = Table(
     Column('added_at', DateTime, default=datetime.utcnow)
 )
 
+# Spotify users whose library holds a mirrored playlist (see playlist_mirror.py); a playlist
+# followed by several users is stored once and linked to each of them
+user_playlists = Table(
+    'user_playlists',
+    Base.metadata,
+    Column('user_id', String, primary_key=True),
+    Column('playlist_id', String, ForeignKey('playlists.id'), primary_key=True, index=True),
+    Column('synced_at', DateTime)  # last time the user's library was checked against Spotify
+)
+
+# When each user's library was last mirrored, also for users whose library is empty
+user_library_syncs = Table(
+    'user_library_syncs',
+    Base.metadata,
+    Column('user_id', String, primary_key=True),
+    Column('synced_at', DateTime, nullable=False)
+)
+
 class Playlist(Base):
     __tablename__ = 'playlists'
 
@@ -45,12 +66,15 @@ class Playlist(Base):
     description = Column(String)
     spotify_id = Column(String, unique=True)  # Spotify playlist ID
     meta_data = Column(JSON)  # Additional playlist meta_data
+    snapshot_id = Column(String)  # Spotify snapshot the stored tracks belong to (mirrored playlists)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     brand = relationship("BrandProfile")
-    tracks = relationship("Track", secondary=playlist_tracks, back_populates="playlists")
+    tracks = relationship(
+        "Track", secondary=playlist_tracks, back_populates="playlists", order_by=playlist_tracks.c.position
+    )
 
     def to_dict(self):
         return {
@@ -60,6 +84,7 @@ class Playlist(Base):
             "description": self.description,
             "spotify_id": self.spotify_id,
             "meta_data": self.meta_data,
+            "snapshot_id": self.snapshot_id,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat()
         }
@@ -75,6 +100,7 @@ class Track(Base):
     duration_ms = Column(Integer)
     preview_url = Column(String)
     meta_data = Column(JSON)  # Additional track meta_data from Spotify
+    hydrated_at = Column(DateTime, index=True)  # last metadata fetch from Spotify (see track_hydration.py)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -93,4 +119,84 @@ class Track(Base):
             "meta_data": self.meta_data,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class SpotifyAccount(Base):
+    __tablename__ = 'spotify_accounts'
+
+    id = Column(String, primary_key=True)  # Spotify user ID
+    refresh_token = Column(String, nullable=False)  # encrypted, see token_store
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PlaylistSync(Base):
+    """Last sync of a brand playlist in a user's Spotify account, for background refreshes"""
+    __tablename__ = 'playlist_syncs'
+    __table_args__ = (UniqueConstraint('brand_id', 'user_id'),)
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    brand_id = Column(String, ForeignKey('brand_profiles.id', ondelete='CASCADE'), nullable=False)
+    user_id = Column(String, ForeignKey('spotify_accounts.id'), nullable=False)
+    spotify_playlist_id = Column(String)
+    fingerprint = Column(String)  # hash of suggestions and resolved URIs at the last sync
+    last_run_at = Column(DateTime)
+    last_status = Column(String)
+    locked_until = Column(DateTime)  # claim held by the worker currently refreshing it
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "brand_id": self.brand_id,
+            "user_id": self.user_id,
+            "spotify_playlist_id": self.spotify_playlist_id,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_status": self.last_status
+        }
+
+class AuthSession(Base):
+    """Spotify tokens of a login session, kept server-side and encrypted at rest"""
+    __tablename__ = 'auth_sessions'
+
+    id = Column(String, primary_key=True)  # opaque session ID held by the client
+    user_id = Column(String, ForeignKey('spotify_accounts.id'), nullable=False)
+    access_token = Column(String, nullable=False)  # encrypted
+    refresh_token = Column(String, nullable=False)  # encrypted
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+    locked_until = Column(DateTime)  # claimed by a worker's background refresh until then
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BrandSuggestion(Base):
+    """A song suggested for a brand, linked to its Spotify track once resolved"""
+    __tablename__ = 'brand_suggestions'
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    brand_id = Column(String, ForeignKey('brand_profiles.id', ondelete='CASCADE'), nullable=False, index=True)
+    track_id = Column(String, ForeignKey('tracks.id'))  # set when the song resolved on Spotify
+    rank = Column(Integer, nullable=False)
+    title = Column(String, nullable=False)
+    artist = Column(String, nullable=False)
+    reason = Column(String)
+    status = Column(String, nullable=False, default="pending")  # pending, found, not_found
+    confidence = Column(Float)  # match score of the resolved track
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationships
+    track = relationship("Track")
+
+    def to_dict(self):
+        """Same shape as the suggestions returned by suggest-music, plus spotify_data once resolved"""
+        suggestion = {"track": self.title, "artist": self.artist, "reason": self.reason, "status": self.status}
+        if self.track is not None:
+            meta_data = self.track.meta_data or {}
+            suggestion["spotify_data"] = {
+                "uri": f"spotify:track:{self.track.spotify_id}",
+                "preview_url": self.track.preview_url,
+                "external_url": meta_data.get("external_url", f"https://open.spotify.com/track/{self.track.spotify_id}"),
+                "name": self.track.name,
+                "artists": meta_data.get("artists", [self.track.artist]),
+                "confidence": self.confidence
+            }
+        return suggestion
@@ -0,0 +1,374 @@
+"""
+Building brand playlists on Spotify.
+
+The steps of create-playlist are split out so that several brands can share
+one Spotify session: the user profile and the user's playlist index are
+fetched once, and a `SuggestionResolver` searches each distinct song only
+once even when many brands suggest it.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import spotify_client
+from .cache import cache_key, get_cache
+from .config import (
+    LOW_CONFIDENCE_THRESHOLD, PLAYLIST_READ_CONCURRENCY, RESOLUTION_CACHE_TTL, SEARCH_CANDIDATES, TOKEN_CACHE_TTL,
+)
+from .matching import best_match, search_query
+from sqlalchemy.orm import joinedload
+
+from .models import BrandSuggestion, PlaylistSync, SpotifyAccount, Track
+
+logger = logging.getLogger(__name__)
+
+# Spotify accepts at most 100 tracks per add/replace call, and returns at most 100 per page
+PLAYLIST_WRITE_BATCH = 100
+PLAYLIST_PAGE_SIZE = 100
+# Only the track URIs are used when reading a playlist
+PLAYLIST_ITEM_FIELDS = "total,items(track(uri))"
+
+# Optional callback receiving progress events (plain dicts) as work completes
+Progress = Optional[Callable[[Dict], None]]
+
+# Shared across worker processes: access token -> user profile, (track, artist) -> Spotify match
+token_cache = get_cache("spotify_user", default_ttl=TOKEN_CACHE_TTL)
+resolution_cache = get_cache("track_match", default_ttl=RESOLUTION_CACHE_TTL)
+
+def brand_playlist_name(brand_name: str) -> str:
+    return f"{brand_name} Brand Playlist"
+
+async def cached_user(token: str) -> Optional[Dict]:
+    """The token's user if Spotify already confirmed the token, without calling Spotify"""
+    return await token_cache.aget(cache_key(token))
+
+async def get_current_user(sp, token: str) -> Dict:
+    """Spotify profile of the token's user, cached per token"""
+    user = await cached_user(token)
+    if user is None:
+        profile = await spotify_client.call(sp.current_user)
+        user = {"id": profile["id"]}
+        await token_cache.aset(cache_key(token), user)
+    return user
+
+async def find_playlists(sp, user_id: str, names: Iterable[str]) -> Dict[str, Dict]:
+    """Scan the user's playlists once, stopping early when every wanted name is found"""
+    wanted = set(names)
+    found = {}
+    offset = 0
+    limit = 50
+
+    while True:
+        playlists = await spotify_client.call(sp.user_playlists, user_id, limit=limit, offset=offset)
+        logger.debug(f"Checking batch of {len(playlists['items'])} playlists")
+
+        for pl in playlists['items']:
+            if pl['name'] in wanted and pl['name'] not in found:
+                found[pl['name']] = pl
+                logger.info(f"Found existing playlist: {pl['id']}")
+
+        if len(found) == len(wanted) or not playlists['next']:
+            return found
+
+        offset += limit
+
+async def cached_resolution(track: str, artist: str) -> Optional[Dict]:
+    """Spotify match for a song from an earlier search, {} if it was not found, None if never searched"""
+    return await resolution_cache.aget(cache_key(track.lower(), artist.lower()))
+
+class SuggestionResolver:
+    """
+    Resolves (track, artist) suggestions to Spotify tracks, searching each
+    song once. A relaxed query fetches SEARCH_CANDIDATES results, which are
+    scored locally; the best one above the match threshold wins and its
+    score is kept as spotify_data['confidence'].
+    """
+
+    def __init__(self, sp):
+        self.sp = sp
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    async def _search(self, track: str, artist: str) -> Dict:
+        resolved = await cached_resolution(track, artist)
+        if resolved is None:
+            results = await spotify_client.call(
+                self.sp.search, q=search_query(track, artist), type='track', limit=SEARCH_CANDIDATES
+            )
+            match, score = best_match(track, artist, results['tracks']['items'])
+            if match:
+                resolved = {
+                    'uri': match['uri'],
+                    'preview_url': match['preview_url'],
+                    'external_url': match['external_urls']['spotify'],
+                    'name': match['name'],
+                    'artists': [credit['name'] for credit in match['artists']],
+                    'confidence': round(score, 3)
+                }
+            else:
+                logger.info(f"No match for {track} by {artist} (best score {score:.2f})")
+                resolved = {}
+            await resolution_cache.aset(cache_key(track.lower(), artist.lower()), resolved)
+        return resolved
+
+    async def resolve(self, item: Dict) -> Dict:
+        """Spotify data for a suggestion, or {} when not found"""
+        key = f"{item['track'].lower()}\x1f{item['artist'].lower()}"
+        if key not in self._pending:
+            self._pending[key] = asyncio.ensure_future(self._search(item['track'], item['artist']))
+        return await self._pending[key]
+
+    async def resolve_all(self, suggestions: List[Dict], progress: Progress = None) -> Tuple[List[str], List[str]]:
+        """Resolve suggestions concurrently, setting item['spotify_data']; returns (uris, not_found)"""
+        async def resolve_item(item):
+            try:
+                resolved = await self.resolve(item)
+            except Exception as e:
+                logger.error(f"Error searching for track {item['track']}: {str(e)}")
+                resolved = None
+            if progress:
+                progress({
+                    "event": "track",
+                    "track": item['track'],
+                    "artist": item['artist'],
+                    "status": "found" if resolved else ("not_found" if resolved is not None else "error"),
+                    **(resolved or {})
+                })
+            return item, resolved
+
+        new_track_uris = []
+        not_found = []
+        for item, resolved in await asyncio.gather(*[resolve_item(item) for item in suggestions]):
+            if resolved:
+                new_track_uris.append(resolved['uri'])
+                item['spotify_data'] = resolved
+            elif resolved is not None:
+                not_found.append(f"{item['track']} by {item['artist']}")
+        return new_track_uris, not_found
+
+async def read_playlist_items(sp, playlist_id: str, fields: str = PLAYLIST_ITEM_FIELDS) -> List[Dict]:
+    """
+    All items of a playlist, limited to `fields`. Once the first page gives
+    the total, the remaining pages are fetched concurrently by offset
+    (PLAYLIST_READ_CONCURRENCY at a time, all under the shared rate limiter).
+    """
+    async def read_page(offset: int) -> Dict:
+        return await spotify_client.call(
+            sp.playlist_items, playlist_id, fields=fields, limit=PLAYLIST_PAGE_SIZE, offset=offset
+        )
+
+    first_page = await read_page(0)
+    semaphore = asyncio.Semaphore(PLAYLIST_READ_CONCURRENCY)
+
+    async def read_later_page(offset: int) -> Dict:
+        async with semaphore:
+            return await read_page(offset)
+
+    pages = [first_page] + await asyncio.gather(*[
+        read_later_page(offset) for offset in range(PLAYLIST_PAGE_SIZE, first_page['total'], PLAYLIST_PAGE_SIZE)
+    ])
+    return [item for page in pages for item in page['items']]
+
+async def read_playlist_uris(sp, playlist_id: str) -> List[str]:
+    """URIs of the tracks currently in a playlist; only the URI field is requested"""
+    return [item['track']['uri'] for item in await read_playlist_items(sp, playlist_id) if item.get('track')]
+
+async def write_tracks(sp, playlist_id: str, uris: List[str], replace: bool = False, progress: Progress = None):
+    """Add (or with replace, set) a playlist's tracks in batches of PLAYLIST_WRITE_BATCH"""
+    batches = [uris[start:start + PLAYLIST_WRITE_BATCH] for start in range(0, len(uris), PLAYLIST_WRITE_BATCH)]
+    if replace and not batches:
+        batches = [[]]
+    written = 0
+    for index, batch in enumerate(batches):
+        if replace and index == 0:
+            await spotify_client.call(sp.playlist_replace_items, playlist_id, batch)
+        else:
+            await spotify_client.call(sp.playlist_add_items, playlist_id, batch)
+        written += len(batch)
+        if progress:
+            progress({"event": "write", "playlist_id": playlist_id, "tracks": len(batch), "written": written, "total": len(uris)})
+
+async def sync_playlist(
+    sp,
+    user_id: str,
+    brand_name: str,
+    existing_playlist: Optional[Dict],
+    new_track_uris: List[str],
+    progress: Progress = None
+) -> str:
+    """Create the brand playlist or refresh an existing one; returns the playlist id"""
+    if existing_playlist:
+        playlist_id = existing_playlist['id']
+        logger.info(f"Updating existing playlist: {playlist_id}")
+        if progress:
+            progress({"event": "playlist", "playlist_id": playlist_id, "status": "located"})
+
+        current_tracks = await read_playlist_uris(sp, playlist_id)
+        total_tracks = len(current_tracks)
+        if total_tracks > 0:
+            # Keep half of the existing tracks
+            tracks_to_keep = total_tracks // 2
+            kept_tracks = random.sample(current_tracks, min(tracks_to_keep, len(current_tracks)))
+
+            # Remove all current tracks and add back kept tracks + new tracks
+            logger.info(f"Replacing playlist tracks. Keeping {len(kept_tracks)} existing tracks")
+            all_tracks = kept_tracks + new_track_uris[:total_tracks - len(kept_tracks)]
+
+            await write_tracks(sp, playlist_id, all_tracks, replace=True, progress=progress)
+        elif new_track_uris:
+            # If playlist is empty, just add all new tracks
+            await write_tracks(sp, playlist_id, new_track_uris, progress=progress)
+        return playlist_id
+
+    logger.info("Creating new playlist")
+    new_playlist = await spotify_client.call(
+        sp.user_playlist_create,
+        user=user_id,
+        name=brand_playlist_name(brand_name),
+        public=False,
+        description=f"A curated playlist for {brand_name}"
+    )
+    playlist_id = new_playlist['id']
+    if progress:
+        progress({"event": "playlist", "playlist_id": playlist_id, "status": "created"})
+    if new_track_uris:
+        await write_tracks(sp, playlist_id, new_track_uris, progress=progress)
+    return playlist_id
+
+def low_confidence_matches(suggestions: List[Dict]) -> List[Dict]:
+    """Resolved suggestions whose match scored below LOW_CONFIDENCE_THRESHOLD, for review"""
+    matches = []
+    for item in suggestions:
+        spotify_data = item.get('spotify_data') or {}
+        confidence = spotify_data.get('confidence')
+        if confidence is not None and confidence < LOW_CONFIDENCE_THRESHOLD:
+            matches.append({
+                "track": item['track'],
+                "artist": item['artist'],
+                "matched_name": spotify_data.get('name'),
+                "matched_artists": spotify_data.get('artists'),
+                "uri": spotify_data['uri'],
+                "confidence": spotify_data['confidence']
+            })
+    return matches
+
+def playlist_result(playlist_id: str, new_track_uris: List[str], not_found: List[str], suggestions: List[Dict]) -> Dict:
+    return {
+        "playlist_id": playlist_id,
+        "tracks_added": len(new_track_uris),
+        "tracks_not_found": not_found,
+        "low_confidence": low_confidence_matches(suggestions),
+        "playlist_url": f"https://open.spotify.com/playlist/{playlist_id}"
+    }
+
+def suggestions_by_brand(db, brand_ids: Iterable[str]) -> Dict[str, List[Dict]]:
+    """Saved suggestions of several brands in rank order, with one query"""
+    rows = (
+        db.query(BrandSuggestion)
+        .options(joinedload(BrandSuggestion.track))
+        .filter(BrandSuggestion.brand_id.in_(list(brand_ids)))
+        .order_by(BrandSuggestion.brand_id, BrandSuggestion.rank)
+        .all()
+    )
+    suggestions = {}
+    for row in rows:
+        suggestions.setdefault(row.brand_id, []).append(row.to_dict())
+    return suggestions
+
+def stored_suggestions(db, brand_id: str) -> List[Dict]:
+    """Suggestions last saved for a brand, in rank order"""
+    return suggestions_by_brand(db, [brand_id]).get(brand_id, [])
+
+def unresolved(suggestions: List[Dict]) -> List[Dict]:
+    """Copies of suggestions without earlier resolution results, ready to resolve again"""
+    return [{key: value for key, value in item.items() if key not in ('spotify_data', 'status')} for item in suggestions]
+
+def _tracks_for(db, suggestions: List[Dict]) -> Dict[str, Track]:
+    """Track rows of the resolved suggestions by Spotify ID, adding those not stored yet"""
+    resolved = {}
+    for item in suggestions:
+        uri = (item.get('spotify_data') or {}).get('uri', '')
+        if uri.startswith('spotify:track:'):
+            resolved[uri.rsplit(':', 1)[1]] = item
+
+    # Tracks added earlier in the same unflushed transaction, e.g. by another brand of a pipeline
+    tracks = {obj.spotify_id: obj for obj in db.new if isinstance(obj, Track) and obj.spotify_id in resolved}
+    missing = [spotify_id for spotify_id in resolved if spotify_id not in tracks]
+    if missing:
+        tracks.update({track.spotify_id: track for track in db.query(Track).filter(Track.spotify_id.in_(missing)).all()})
+    for spotify_id, item in resolved.items():
+        if spotify_id not in tracks:
+            spotify_data = item['spotify_data']
+            artists = spotify_data.get('artists') or [item['artist']]
+            tracks[spotify_id] = Track(
+                id=str(uuid.uuid4()),
+                spotify_id=spotify_id,
+                name=spotify_data.get('name') or item['track'],
+                artist=", ".join(artists),
+                preview_url=spotify_data.get('preview_url'),
+                meta_data={"external_url": spotify_data.get('external_url'), "artists": artists}
+            )
+            db.add(tracks[spotify_id])
+    return tracks
+
+def store_suggestions(db, brand_id: str, suggestions: List[Dict]):
+    """
+    Save resolved suggestions (items with spotify_data were found, the rest
+    were not) as the brand's suggestion rows. Rows for the same song are
+    reused, so only changed rows are written; caller commits.
+    """
+    existing: Dict[Tuple[str, str], List[BrandSuggestion]] = {}
+    for row in db.query(BrandSuggestion).filter(BrandSuggestion.brand_id == brand_id).order_by(BrandSuggestion.rank):
+        existing.setdefault((row.title.lower(), row.artist.lower()), []).append(row)
+    tracks = _tracks_for(db, suggestions)
+
+    for rank, item in enumerate(suggestions):
+        spotify_data = item.get('spotify_data') or {}
+        track = tracks.get(spotify_data.get('uri', '').rsplit(':', 1)[-1]) if spotify_data else None
+        values = {
+            "rank": rank,
+            "title": item['track'],
+            "artist": item['artist'],
+            "reason": item.get('reason'),
+            "track_id": track.id if track else None,
+            "status": "found" if track else "not_found",
+            "confidence": spotify_data.get('confidence') if track else None
+        }
+        rows = existing.get((item['track'].lower(), item['artist'].lower()))
+        if rows:
+            row = rows.pop(0)
+            for key, value in values.items():
+                if getattr(row, key) != value:
+                    setattr(row, key, value)
+        else:
+            db.add(BrandSuggestion(brand_id=brand_id, **values))
+
+    stale_ids = [row.id for rows in existing.values() for row in rows]
+    if stale_ids:
+        db.query(BrandSuggestion).filter(BrandSuggestion.id.in_(stale_ids)).delete(synchronize_session=False)
+
+def suggestions_fingerprint(suggestions: List[Dict]) -> str:
+    """Hash of the suggested songs and the URIs they resolved to"""
+    entries = [
+        [item['track'].lower(), item['artist'].lower(), (item.get('spotify_data') or {}).get('uri')]
+        for item in suggestions
+    ]
+    return hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+
+def record_sync(db, brand_id: str, user_id: str, playlist_id: str, suggestions: List[Dict], status: str = "synced"):
+    """Remember a brand playlist sync so the scheduler can refresh it; caller commits"""
+    if db.query(SpotifyAccount.id).filter(SpotifyAccount.id == user_id).first() is None:
+        # No stored refresh token for this user, so it cannot be refreshed in the background
+        return
+    sync = db.query(PlaylistSync).filter_by(brand_id=brand_id, user_id=user_id).first()
+    if sync is None:
+        sync = PlaylistSync(brand_id=brand_id, user_id=user_id)
+        db.add(sync)
+    sync.spotify_playlist_id = playlist_id
+    sync.fingerprint = suggestions_fingerprint(suggestions)
+    sync.last_run_at = datetime.utcnow()
+    sync.last_status = status
@@ -0,0 +1,255 @@
+"""
+Local mirror of users' Spotify playlists.
+
+Playlists are stored once per Spotify ID, linked to users through `user_playlists`,
+and re-read only when their snapshot_id changes.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from . import spotify_client
+from .config import PLAYLIST_MIRROR_CONCURRENCY, PLAYLIST_MIRROR_MAX_AGE
+from .models import Playlist, Track, playlist_tracks, user_library_syncs, user_playlists
+from .playlist_builder import read_playlist_items
+
+logger = logging.getLogger(__name__)
+
+USER_PLAYLISTS_PAGE_SIZE = 50
+MIRROR_ITEM_FIELDS = (
+    "total,items(added_at,track(id,name,duration_ms,preview_url,album(name),artists(name),external_urls))"
+)
+# Keeps IN (...) lists well below SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+async def list_user_playlists(sp) -> List[Dict]:
+    """Every playlist in the current user's library, pages after the first fetched concurrently"""
+    async def read_page(offset: int) -> Dict:
+        return await spotify_client.call(sp.current_user_playlists, limit=USER_PLAYLISTS_PAGE_SIZE, offset=offset)
+
+    first_page = await read_page(0)
+    pages = [first_page] + await asyncio.gather(*[
+        read_page(offset) for offset in range(USER_PLAYLISTS_PAGE_SIZE, first_page['total'], USER_PLAYLISTS_PAGE_SIZE)
+    ])
+    return [playlist for page in pages for playlist in page['items'] if playlist]
+
+def playlist_meta(listed: Dict) -> Dict:
+    """What the listing says about a playlist, the same for every user"""
+    owner = listed.get('owner') or {}
+    return {
+        "images": listed.get('images') or [],
+        "owner": {"id": owner.get('id'), "display_name": owner.get('display_name')},
+        "public": listed.get('public'),
+        "collaborative": listed.get('collaborative'),
+        "total_tracks": (listed.get('tracks') or {}).get('total', 0),
+        "external_url": (listed.get('external_urls') or {}).get('spotify'),
+    }
+
+def is_stale(synced_at: Optional[datetime], now: Optional[datetime] = None) -> bool:
+    now = now or datetime.utcnow()
+    return synced_at is None or synced_at < now - timedelta(seconds=PLAYLIST_MIRROR_MAX_AGE)
+
+def user_library(db, user_id: str) -> List[Tuple[Playlist, Optional[datetime]]]:
+    """The user's mirrored playlists by name, each with when the user's library was last checked"""
+    return (
+        db.query(Playlist, user_playlists.c.synced_at)
+        .join(user_playlists, user_playlists.c.playlist_id == Playlist.id)
+        .filter(user_playlists.c.user_id == user_id)
+        .order_by(Playlist.name)
+        .all()
+    )
+
+def library_synced_at(db, user_id: str) -> Optional[datetime]:
+    """When the user's library was last mirrored, None if it never was"""
+    return db.query(user_library_syncs.c.synced_at).filter(user_library_syncs.c.user_id == user_id).scalar()
+
+def _mark_library_synced(db, user_id: str, now: datetime):
+    marked = db.execute(update(user_library_syncs).where(user_library_syncs.c.user_id == user_id).values(synced_at=now))
+    if not marked.rowcount:
+        db.execute(insert(user_library_syncs).values(user_id=user_id, synced_at=now))
+
+def user_playlist(db, user_id: str, spotify_id: str) -> Optional[Tuple[Playlist, Optional[datetime]]]:
+    """One playlist of the user's mirrored library by Spotify ID, None if the library doesn't hold it"""
+    return (
+        db.query(Playlist, user_playlists.c.synced_at)
+        .join(user_playlists, user_playlists.c.playlist_id == Playlist.id)
+        .filter(user_playlists.c.user_id == user_id, Playlist.spotify_id == spotify_id)
+        .first()
+    )
+
+def _add_new(db, model, new: Dict[str, object]) -> Dict[str, object]:
+    """
+    Insert new rows keyed by their unique Spotify ID, in a savepoint; rows
+    another worker stored meanwhile are read back instead. Returns the rows
+    by Spotify ID.
+    """
+    rows = {}
+    while new:
+        try:
+            with db.begin_nested():
+                db.add_all(new.values())
+            rows.update(new)
+            break
+        except IntegrityError:
+            # The savepoint rolled back only these inserts; keep the rows that won and retry the rest
+            won = {
+                row.spotify_id: row for start in range(0, len(new), LOOKUP_CHUNK)
+                for row in db.query(model).filter(model.spotify_id.in_(list(new)[start:start + LOOKUP_CHUNK]))
+            }
+            if not won:
+                raise
+            rows.update(won)
+            new = {spotify_id: row for spotify_id, row in new.items() if spotify_id not in won}
+    return rows
+
+def _stored_tracks(db, items: Iterable[Dict]) -> Dict[str, Track]:
+    """Track rows for playlist items by Spotify ID, adding (and flushing) those not stored yet; caller commits"""
+    found = {item['track']['id']: item['track'] for item in items}
+    tracks: Dict[str, Track] = {}
+    spotify_ids = list(found)
+    for start in range(0, len(spotify_ids), LOOKUP_CHUNK):
+        chunk = spotify_ids[start:start + LOOKUP_CHUNK]
+        tracks.update({track.spotify_id: track for track in db.query(Track).filter(Track.spotify_id.in_(chunk))})
+    new = {}
+    for spotify_id, track in found.items():
+        if spotify_id in tracks:
+            continue
+        artists = [artist['name'] for artist in track.get('artists') or []]
+        new[spotify_id] = Track(
+            id=str(uuid.uuid4()),
+            spotify_id=spotify_id,
+            name=track.get('name') or '',
+            artist=", ".join(artists),
+            album=(track.get('album') or {}).get('name'),
+            duration_ms=track.get('duration_ms'),
+            preview_url=track.get('preview_url'),
+            meta_data={"external_url": (track.get('external_urls') or {}).get('spotify'), "artists": artists},
+            # Playlist items carry the same fields the hydration would fetch
+            hydrated_at=datetime.utcnow()
+        )
+    tracks.update(_add_new(db, Track, new))
+    return tracks
+
+def _replace_items(db, changed: List[Tuple[Playlist, List[Dict]]], tracks: Dict[str, Track]):
+    """Swap the stored items of the changed playlists for the ones just read, in two statements"""
+    if not changed:
+        return
+    db.execute(delete(playlist_tracks).where(playlist_tracks.c.playlist_id.in_([playlist.id for playlist, _ in changed])))
+    rows = []
+    for playlist, items in changed:
+        seen = set()
+        for position, item in enumerate(items):
+            track_id = tracks[item['track']['id']].id
+            if track_id in seen:
+                # The association is keyed by (playlist, track); a repeated track keeps its first position
+                continue
+            seen.add(track_id)
+            added_at = item.get('added_at')
+            rows.append({
+                "playlist_id": playlist.id,
+                "track_id": track_id,
+                "position": position,
+                "added_at": datetime.fromisoformat(added_at.replace('Z', '+00:00')).replace(tzinfo=None) if added_at else None
+            })
+    if rows:
+        db.execute(insert(playlist_tracks), rows)
+
+def _set_if_changed(playlist: Playlist, **values):
+    # Unchanged playlists then cost no UPDATE
+    for key, value in values.items():
+        if getattr(playlist, key) != value:
+            setattr(playlist, key, value)
+
+def _drop_unlinked(db, playlists: List[Playlist]) -> int:
+    """Delete the playlists no user's library and no brand refers to any more; returns how many"""
+    candidates = [playlist for playlist in playlists if not playlist.brand_id]
+    if not candidates:
+        return 0
+    linked = {
+        playlist_id for (playlist_id,) in db.query(user_playlists.c.playlist_id)
+        .filter(user_playlists.c.playlist_id.in_([playlist.id for playlist in candidates]))
+        .distinct()
+    }
+    orphans = [playlist for playlist in candidates if playlist.id not in linked]
+    if orphans:
+        db.execute(delete(playlist_tracks).where(playlist_tracks.c.playlist_id.in_([playlist.id for playlist in orphans])))
+        for playlist in orphans:
+            db.delete(playlist)
+    return len(orphans)
+
+async def mirror_user_playlists(sp, db, user_id: str) -> Dict:
+    """Bring the user's mirrored playlists up to date; returns counts of what changed"""
+    listed = await list_user_playlists(sp)
+    listed_ids = [playlist['id'] for playlist in listed]
+    linked = {playlist.spotify_id: playlist for playlist, _ in user_library(db, user_id)}
+    stored = dict(linked)
+    missing_ids = [spotify_id for spotify_id in listed_ids if spotify_id not in stored]
+    for start in range(0, len(missing_ids), LOOKUP_CHUNK):
+        # Mirrored for another user, or created through the API, before this user's library held it
+        chunk = missing_ids[start:start + LOOKUP_CHUNK]
+        stored.update({playlist.spotify_id: playlist for playlist in db.query(Playlist).filter(Playlist.spotify_id.in_(chunk))})
+
+    stored.update(_add_new(db, Playlist, {
+        item['id']: Playlist(id=str(uuid.uuid4()), spotify_id=item['id'], name=item['name'])
+        for item in listed if item['id'] not in stored
+    }))
+
+    now = datetime.utcnow()
+    changed = []
+    for item in listed:
+        playlist = stored[item['id']]
+        _set_if_changed(
+            playlist,
+            name=item['name'],
+            description=item.get('description') or None,
+            meta_data=playlist_meta(item)
+        )
+        if playlist.snapshot_id != item.get('snapshot_id'):
+            changed.append((playlist, item.get('snapshot_id')))
+
+    semaphore = asyncio.Semaphore(PLAYLIST_MIRROR_CONCURRENCY)
+
+    async def read_items(spotify_id: str) -> List[Dict]:
+        async with semaphore:
+            items = await read_playlist_items(sp, spotify_id, fields=MIRROR_ITEM_FIELDS)
+        # Local files and unavailable tracks have no Spotify ID
+        return [item for item in items if (item.get('track') or {}).get('id')]
+
+    changed_items = await asyncio.gather(*[read_items(playlist.spotify_id) for playlist, _ in changed])
+    tracks = _stored_tracks(db, [item for items in changed_items for item in items])
+    db.flush()
+    _replace_items(db, [(playlist, items) for (playlist, _), items in zip(changed, changed_items)], tracks)
+    for playlist, snapshot_id in changed:
+        playlist.snapshot_id = snapshot_id
+
+    listed_set = set(listed_ids)
+    new_links = [
+        {"user_id": user_id, "playlist_id": stored[spotify_id].id, "synced_at": now}
+        for spotify_id in dict.fromkeys(listed_ids) if spotify_id not in linked
+    ]
+    if new_links:
+        db.execute(insert(user_playlists), new_links)
+    # One statement marks every checked playlist of the user, changed or not
+    db.execute(update(user_playlists).where(user_playlists.c.user_id == user_id).values(synced_at=now))
+
+    gone = [playlist for spotify_id, playlist in linked.items() if spotify_id not in listed_set]
+    if gone:
+        db.execute(
+            delete(user_playlists)
+            .where(user_playlists.c.user_id == user_id)
+            .where(user_playlists.c.playlist_id.in_([playlist.id for playlist in gone]))
+        )
+    dropped = _drop_unlinked(db, gone)
+    _mark_library_synced(db, user_id, now)
+
+    db.commit()
+    logger.info(
+        f"Mirrored {len(listed)} playlists for {user_id}: {len(changed)} re-read, "
+        f"{len(gone)} left the library ({dropped} dropped)"
+    )
+    return {"playlists": len(listed), "refetched": len(changed), "removed": len(gone), "synced_at": now.isoformat()}
@@ -0,0 +1,100 @@
+"""
+Per-request SQL query counting.
+
+A SQLAlchemy event listener records every statement issued while a request
+(or a `count_queries()` block) is active, so routes that start issuing more
+queries than their budget allows show up in the logs and in tests.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+
+from .config import QUERY_BUDGET_DEFAULT, QUERY_BUDGETS, QUERY_COUNT_HEADER
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER_NAME = "x-query-count"
+
+class QueryCounter:
+    """Statements executed within a single request or test block"""
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+_current_counter: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _current_counter.get()
+    if counter is not None:
+        counter.statements.append(statement)
+
+def install_query_counter(engine):
+    """Attach the statement counter to an engine (idempotent)"""
+    if not event.contains(engine, "before_cursor_execute", _record_statement):
+        event.listen(engine, "before_cursor_execute", _record_statement)
+
+@contextmanager
+def count_queries():
+    """Count the statements executed in the current context"""
+    counter = QueryCounter()
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _current_counter.reset(token)
+
+def get_query_budget(route_key: str) -> int:
+    """Get the query budget for a "METHOD /path" route key"""
+    return QUERY_BUDGETS.get(route_key, QUERY_BUDGET_DEFAULT)
+
+class QueryBudgetMiddleware:
+    """ASGI middleware that counts queries per request and logs budget overruns"""
+
+    def __init__(self, app, expose_header: bool = QUERY_COUNT_HEADER):
+        self.app = app
+        self.expose_header = expose_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with count_queries() as counter:
+            async def send_with_count(message):
+                if message["type"] == "http.response.start" and self.expose_header:
+                    headers = list(message.get("headers", []))
+                    headers.append((QUERY_COUNT_HEADER_NAME.encode(), str(counter.count).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_count)
+
+        # The router stores the matched route in the shared scope
+        route = scope.get("route")
+        route_key = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+        budget = get_query_budget(route_key)
+        if counter.count > budget:
+            logger.warning(
+                f"Query budget exceeded for {route_key}: {counter.count} queries (budget {budget})\n"
+                + "\n".join(f"  [{i}] {statement}" for i, statement in enumerate(counter.statements, 1))
+            )
+
+def assert_max_queries(client, method: str, url: str, max_queries: int, **kwargs):
+    """
+    Test helper: call an endpoint through a TestClient and fail if it issued
+    more than max_queries statements. Requires QUERY_COUNT_HEADER to be enabled.
+    """
+    response = client.request(method, url, **kwargs)
+    if QUERY_COUNT_HEADER_NAME not in response.headers:
+        raise AssertionError(f"{method} {url} returned no {QUERY_COUNT_HEADER_NAME} header")
+    count = int(response.headers[QUERY_COUNT_HEADER_NAME])
+    if count > max_queries:
+        raise AssertionError(f"{method} {url} issued {count} queries, expected at most {max_queries}")
+    return response
@@ -0,0 +1,53 @@
+"""
+Fast JSON response helpers.
+
+Payloads built by our own code (ORM rows via `to_dict()`, parsed profiles,
+suggestion lists) are serialized straight to bytes with orjson. That skips
+FastAPI's `response_model` re-validation and `jsonable_encoder` pass while
+producing the same JSON shape as the Pydantic response models.
+
+`etag_json_response` additionally derives a strong ETag from a hash of the
+serialized content and answers `If-None-Match` revalidations with an empty
+304 instead of resending the body.
+"""
+import hashlib
+from typing import Any, Dict, Optional
+
+import orjson
+from fastapi import Request, Response
+
+def dumps(payload: Any, sort_keys: bool = False) -> bytes:
+    """Serialize a payload of plain Python/JSON types (datetimes included) to JSON bytes"""
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(payload, default=str, option=option)
+
+def json_response(payload: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Return an already trusted payload as JSON without re-validation"""
+    return Response(content=dumps(payload), status_code=status_code, media_type="application/json", headers=headers)
+
+def content_etag(body: bytes) -> str:
+    """Strong ETag for a serialized response body"""
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+def etag_json_response(request: Request, payload: Any, status_code: int = 200) -> Response:
+    """Serialize payload to JSON and return 304 when the client already has it"""
+    # Sorted keys keep the ETag stable regardless of dict insertion order
+    return etag_response(request, dumps(payload, sort_keys=True), status_code)
+
+def etag_response(request: Request, body: bytes, status_code: int = 200) -> Response:
+    """Return already serialized JSON, or 304 when the client already has it"""
+    etag = content_etag(body)
+    # no-cache: clients may store the response but must revalidate it on every use
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
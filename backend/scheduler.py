@@ -0,0 +1,156 @@
+"""
+Background refresh of brand playlists.
+
+Every playlist synced through create-playlist is recorded in
+`playlist_syncs` together with a fingerprint of the suggestions and the
+Spotify URIs they resolved to. The scheduler wakes up periodically, claims
+the approved brands' syncs that are due and refreshes them one by one,
+spread over the interval so Spotify sees a steady trickle instead of a
+burst. A sync whose fingerprint is unchanged is skipped, and when every
+song is still in the resolution cache that decision costs no Spotify call.
+
+Claims are a conditional UPDATE on `locked_until`, so several workers can
+run the scheduler against one database without refreshing a playlist twice.
+After each pass, stored tracks with missing or old metadata are hydrated.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import or_, update
+
+from . import spotify_client, token_store
+from .config import SCHEDULER_INTERVAL, SCHEDULER_LOCK_TTL
+from .database import SessionLocal
+from .models import BrandProfile, PlaylistSync, SpotifyAccount
+from .playlist_builder import (
+    SuggestionResolver, cached_resolution, store_suggestions, stored_suggestions,
+    suggestions_fingerprint, sync_playlist, unresolved,
+)
+from .track_hydration import hydrate_tracks
+
+logger = logging.getLogger(__name__)
+
+def due_syncs(db, now: datetime) -> List[PlaylistSync]:
+    """Syncs of approved brands not refreshed within the interval and not claimed by another worker"""
+    cutoff = now - timedelta(seconds=SCHEDULER_INTERVAL)
+    rows = (
+        db.query(PlaylistSync, BrandProfile)
+        .join(BrandProfile, PlaylistSync.brand_id == BrandProfile.id)
+        .filter(or_(PlaylistSync.last_run_at.is_(None), PlaylistSync.last_run_at < cutoff))
+        .filter(or_(PlaylistSync.locked_until.is_(None), PlaylistSync.locked_until < now))
+        .all()
+    )
+    return [sync for sync, brand in rows if brand.data.get("status") == "approved"]
+
+def claim(db, row_id: str, now: datetime, model=PlaylistSync, ttl: float = SCHEDULER_LOCK_TTL) -> bool:
+    """Take the work on a row with a `locked_until` column for this worker; False when someone else holds it"""
+    result = db.execute(
+        update(model)
+        .where(model.id == row_id)
+        .where(or_(model.locked_until.is_(None), model.locked_until < now))
+        .values(locked_until=now + timedelta(seconds=ttl))
+    )
+    db.commit()
+    return result.rowcount == 1
+
+async def cached_fingerprint(suggestions: List[Dict]) -> Optional[str]:
+    """Fingerprint from cached resolutions only, or None if a song would need a Spotify search"""
+    resolved = []
+    for item in suggestions:
+        spotify_data = await cached_resolution(item['track'], item['artist'])
+        if spotify_data is None:
+            return None
+        resolved.append({**item, 'spotify_data': spotify_data})
+    return suggestions_fingerprint(resolved)
+
+async def refresh_sync(db, sync: PlaylistSync, tokens: Dict[str, str]) -> str:
+    """Refresh one brand playlist; returns the status recorded for the run"""
+    brand = db.query(BrandProfile).filter(BrandProfile.id == sync.brand_id).first()
+    suggestions = stored_suggestions(db, brand.id) if brand else []
+    if not suggestions:
+        return "no_suggestions"
+
+    fingerprint = await cached_fingerprint(suggestions)
+    if fingerprint is not None and fingerprint == sync.fingerprint:
+        return "unchanged"
+
+    if sync.user_id not in tokens:
+        tokens[sync.user_id] = await token_store.user_access_token(db, sync.user_id)
+    sp = spotify_client.get_client(tokens[sync.user_id])
+
+    suggestions = unresolved(suggestions)
+    new_track_uris, not_found = await SuggestionResolver(sp).resolve_all(suggestions)
+    fingerprint = suggestions_fingerprint(suggestions)
+    if fingerprint == sync.fingerprint:
+        return "unchanged"
+
+    existing_playlist = {"id": sync.spotify_playlist_id} if sync.spotify_playlist_id else None
+    sync.spotify_playlist_id = await sync_playlist(sp, sync.user_id, brand.name, existing_playlist, new_track_uris)
+    sync.fingerprint = fingerprint
+    store_suggestions(db, brand.id, suggestions)
+    logger.info(f"Refreshed playlist for {brand.id}: {len(new_track_uris)} tracks, {len(not_found)} not found")
+    return "synced"
+
+async def refresh_due_playlists(spread: float = SCHEDULER_INTERVAL) -> int:
+    """Refresh every due playlist, spacing the runs over `spread` seconds; returns how many ran"""
+    db = SessionLocal()
+    try:
+        sync_ids = [sync.id for sync in due_syncs(db, datetime.utcnow())]
+        if not sync_ids:
+            return 0
+        logger.info(f"{len(sync_ids)} brand playlists due for refresh")
+
+        gap = spread / len(sync_ids)
+        tokens: Dict[str, str] = {}
+        refreshed = 0
+        for index, sync_id in enumerate(sync_ids):
+            if index:
+                await asyncio.sleep(gap * random.uniform(0.5, 1.5))
+            if not claim(db, sync_id, datetime.utcnow()):
+                continue
+
+            sync = db.query(PlaylistSync).filter(PlaylistSync.id == sync_id).first()
+            try:
+                status = await refresh_sync(db, sync, tokens)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error refreshing playlist sync {sync_id}: {str(e)}")
+                status = "failed"
+            sync.last_run_at = datetime.utcnow()
+            sync.last_status = status
+            sync.locked_until = None
+            db.commit()
+            refreshed += 1
+        return refreshed
+    finally:
+        db.close()
+
+async def hydrate_stored_tracks() -> Dict:
+    """Hydrate stale tracks with any stored account's token; track metadata is the same for every user"""
+    db = SessionLocal()
+    try:
+        account = db.query(SpotifyAccount.id).first()
+        if account is None:
+            return {"updated": 0, "unavailable": 0}
+        token = await token_store.user_access_token(db, account.id)
+        return await hydrate_tracks(spotify_client.get_client(token), db)
+    finally:
+        db.close()
+
+async def run_scheduler(interval: float = SCHEDULER_INTERVAL):
+    """Refresh due playlists forever; started and cancelled by the app lifespan"""
+    # Stagger workers so they don't all scan the table at the same moment
+    await asyncio.sleep(random.uniform(0, min(60, interval)))
+    while True:
+        try:
+            await refresh_due_playlists(spread=interval / 2)
+        except Exception as e:
+            logger.error(f"Scheduled playlist refresh failed: {str(e)}")
+        try:
+            await hydrate_stored_tracks()
+        except Exception as e:
+            logger.error(f"Scheduled track hydration failed: {str(e)}")
+        await asyncio.sleep(interval / 2 * random.uniform(0.9, 1.1))
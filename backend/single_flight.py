@@ -0,0 +1,68 @@
+"""
+Deduplication of concurrent and repeated operations.
+
+`SingleFlight.run(key, operation)` makes sure an operation runs once per
+key: callers arriving while it is in flight in this worker await the same
+task, and callers in other workers see its claim in the shared cache and
+poll for the result instead of starting their own. The result is kept for
+a short while, so retries arriving just after it finished are answered
+from it too. Errors are not kept; the next caller runs the operation again.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from .cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    def __init__(self, namespace: str, claim_ttl: float, result_ttl: float, poll_interval: float = 0.5):
+        self.claim_ttl = claim_ttl
+        self.poll_interval = poll_interval
+        self._claims = get_cache(f"{namespace}_claims", default_ttl=claim_ttl)
+        self._results = get_cache(f"{namespace}_results", default_ttl=result_ttl)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def run(self, key: str, operation: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Result of the operation for key, and whether it was shared rather than run for this caller"""
+        result = await self._results.aget(key)
+        if result is not None:
+            return result, True
+
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, operation))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded, so a caller that goes away does not cancel the work for the others
+        return await asyncio.shield(task), shared
+
+    async def _run(self, key: str, operation: Callable[[], Awaitable[Any]]) -> Any:
+        while not await self._claims.aadd(key, os.getpid()):
+            # Another worker is running it
+            result = await self._wait_for_result(key)
+            if result is not None:
+                return result
+
+        try:
+            result = await operation()
+            await self._results.aset(key, result)
+            return result
+        finally:
+            await self._claims.adelete(key)
+
+    async def _wait_for_result(self, key: str) -> Any:
+        """The other worker's result, or None once its claim is gone without one (e.g. it failed)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.claim_ttl
+        while loop.time() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            result = await self._results.aget(key)
+            if result is not None:
+                return result
+            if await self._claims.aget(key) is None:
+                return None
+        return None
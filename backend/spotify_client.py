@@ -0,0 +1,121 @@
+"""
+Outbound Spotify Web API calls.
+
+Every Spotify request made by this worker process goes through one shared
+token bucket, so concurrent requests are paced together instead of each
+sleeping a fixed amount. 429 responses are retried with jittered
+exponential backoff, and so are 5xx responses to idempotent calls; a 5xx
+to a write such as adding tracks may come after the write was applied, so
+it is not repeated. A 429's Retry-After pauses the whole bucket, because
+Spotify throttles the app rather than a single request.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Callable, Mapping, Optional
+
+from .config import (
+    MAX_RETRIES, REQUEST_TIMEOUT, SPOTIFY_BACKOFF_BASE, SPOTIFY_BACKOFF_MAX,
+    SPOTIFY_RATE_BURST, SPOTIFY_RATE_LIMIT,
+)
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Spotipy calls that add something every time they run
+NON_IDEMPOTENT_CALLS = {"user_playlist_create", "playlist_add_items", "user_playlist_add_tracks", "add_to_queue"}
+NON_IDEMPOTENT_METHODS = {"POST", "PATCH"}
+
+class TokenBucket:
+    """Async token bucket allowing `rate` calls per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a call may be made"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hold back every caller for the given time, e.g. after a Retry-After"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+spotify_limiter = TokenBucket(SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST)
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Retry-After when the server sent one, otherwise full-jitter exponential backoff"""
+    if retry_after:
+        try:
+            return min(float(retry_after), SPOTIFY_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(SPOTIFY_BACKOFF_MAX, SPOTIFY_BACKOFF_BASE * 2 ** attempt))
+
+def should_retry(status: int, idempotent: bool) -> bool:
+    """A throttled request never ran, so it is always retried; a failed one only when repeating it is harmless"""
+    return status == 429 or (idempotent and status in RETRY_STATUSES)
+
+async def _wait_before_retry(status: int, headers: Mapping[str, str], attempt: int, what: str):
+    delay = backoff_delay(attempt, headers.get("Retry-After") or headers.get("retry-after"))
+    if status == 429:
+        spotify_limiter.pause(delay)
+    logger.warning(f"Spotify returned {status} for {what}, retrying in {delay:.2f}s (attempt {attempt + 1})")
+    await asyncio.sleep(delay)
+
+_session = None
+
+def get_client(token: str):
+    """Spotify client for an access token, sharing one connection pool per process"""
+    global _session
+    import requests
+    import spotipy
+
+    if _session is None:
+        # A plain session: retries are ours, so 429 errors keep their Retry-After header
+        _session = requests.Session()
+    return spotipy.Spotify(auth=token, requests_session=_session, requests_timeout=REQUEST_TIMEOUT)
+
+async def call(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking spotipy call off the event loop under the rate limiter"""
+    from spotipy import SpotifyException
+
+    idempotent = getattr(func, "__name__", None) not in NON_IDEMPOTENT_CALLS
+    for attempt in range(MAX_RETRIES + 1):
+        await spotify_limiter.acquire()
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        except SpotifyException as e:
+            if not should_retry(e.http_status, idempotent) or attempt == MAX_RETRIES:
+                raise
+            await _wait_before_retry(e.http_status, e.headers or {}, attempt, getattr(func, "__name__", "call"))
+
+async def request(client, method: str, url: str, **kwargs):
+    """Send an httpx request under the rate limiter, retrying throttled (and, if idempotent, failed) responses"""
+    idempotent = method.upper() not in NON_IDEMPOTENT_METHODS
+    for attempt in range(MAX_RETRIES + 1):
+        await spotify_limiter.acquire()
+        response = await client.request(method, url, **kwargs)
+        if not should_retry(response.status_code, idempotent) or attempt == MAX_RETRIES:
+            return response
+        await _wait_before_retry(response.status_code, response.headers, attempt, f"{method} {url}")
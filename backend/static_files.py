@@ -0,0 +1,168 @@
+"""
+Serving of the built React frontend.
+
+Assets under /static are precompressed once (gzip, plus brotli when the
+package is installed) and the best variant for the request's
+Accept-Encoding is streamed from disk, so serving the UI costs no
+compression work per request. Content-hashed files are cached as immutable;
+browser navigations to paths the API does not handle get index.html for
+client-side routing.
+
+Precompress at build time with:
+
+    python -m backend.static_files [static_dir]
+"""
+import gzip
+import logging
+import mimetypes
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from starlette.responses import FileResponse, Response
+from starlette.routing import Match
+
+from .compression import brotli, choose_encoding
+from .config import (
+    BROTLI_STATIC_QUALITY, COMPRESSION_MINIMUM_SIZE, SPA_ROUTES, STATIC_DIR,
+    STATIC_PRECOMPRESS_EXTENSIONS, STATIC_URL_PREFIX,
+)
+
+logger = logging.getLogger(__name__)
+
+# Build tools put an 8+ character content hash in bundle file names, e.g. main.1ff55fc9.js
+HASHED_FILE_PATTERN = re.compile(r"\.[0-9a-f]{8,}\.")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+def _write_atomic(path: Path, data: bytes):
+    # Several workers may precompress at once; never expose a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    with os.fdopen(fd, "wb") as tmp:
+        tmp.write(data)
+    os.replace(tmp_path, path)
+
+def precompress_static(static_dir: str = STATIC_DIR) -> int:
+    """Write .gz/.br siblings for compressible assets that are missing or outdated"""
+    root = Path(static_dir)
+    if not root.is_dir():
+        return 0
+
+    written = 0
+    for path in root.rglob("*"):
+        if not path.is_file() or path.suffix not in STATIC_PRECOMPRESS_EXTENSIONS:
+            continue
+        source_stat = path.stat()
+        if source_stat.st_size < COMPRESSION_MINIMUM_SIZE:
+            continue
+
+        data = None
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            if encoding == "br" and brotli is None:
+                continue
+            target = path.with_name(path.name + suffix)
+            if target.exists() and target.stat().st_mtime >= source_stat.st_mtime:
+                continue
+            if data is None:
+                data = path.read_bytes()
+            if encoding == "br":
+                compressed = brotli.compress(data, quality=BROTLI_STATIC_QUALITY)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            _write_atomic(target, compressed)
+            written += 1
+
+    if written:
+        logger.info(f"Precompressed {written} static asset variants in {root}")
+    return written
+
+def cache_control_for(path: Path) -> str:
+    if path.name == "index.html":
+        return "no-cache"
+    if HASHED_FILE_PATTERN.search(path.name):
+        return IMMUTABLE_CACHE_CONTROL
+    return "public, max-age=3600"
+
+class StaticFilesMiddleware:
+    """
+    ASGI middleware serving the frontend build.
+
+    Handles GET/HEAD for /static/* assets and browser navigations (Accept:
+    text/html) to paths no route of the app matches, or listed in SPA_ROUTES;
+    everything else goes to the app, so /health or /docs are never swallowed
+    by the SPA.
+    """
+
+    def __init__(self, app, static_dir: str = STATIC_DIR):
+        self.app = app
+        self.root = Path(static_dir).resolve()
+        self.index = self.root / "index.html"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD") or not self.index.is_file():
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        path = scope["path"]
+
+        response = None
+        if path.startswith(STATIC_URL_PREFIX + "/"):
+            response = self._asset_response(path[len(STATIC_URL_PREFIX) + 1:], headers)
+        elif "text/html" in headers.get("accept", "") and (path in SPA_ROUTES or not self._routed(scope)):
+            response = self._file_response(self.index, headers)
+
+        if response is None:
+            await self.app(scope, receive, send)
+        else:
+            await response(scope, receive, send)
+
+    @staticmethod
+    def _routed(scope) -> bool:
+        """Whether a route of the app handles the path (for any method)"""
+        app = scope.get("app")
+        if app is None:
+            return False
+        return any(route.matches(scope)[0] != Match.NONE for route in app.router.routes)
+
+    def _asset_response(self, relative_path: str, headers) -> Optional[Response]:
+        path = (self.root / relative_path).resolve()
+        if not path.is_relative_to(self.root) or not path.is_file():
+            return None
+        return self._file_response(path, headers)
+
+    def _file_response(self, path: Path, headers) -> Response:
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        response_headers = {"Cache-Control": cache_control_for(path), "Vary": "Accept-Encoding"}
+
+        serve_path = path
+        encoding = choose_encoding(headers.get("accept-encoding", ""))
+        candidates = [encoding, "gzip"] if encoding == "br" else [encoding]
+        for candidate in candidates:
+            variant = path.with_name(path.name + ENCODING_SUFFIXES.get(candidate, ""))
+            if candidate and variant.is_file():
+                serve_path = variant
+                response_headers["Content-Encoding"] = candidate
+                break
+
+        # A path, not bytes: nothing is read until the body is sent, and the stat also
+        # gives the ETag for the 304 check. Starlette 0.27 has no sendfile and streams it
+        # in chunk_size reads on a worker thread; a server and Starlette supporting the
+        # ASGI pathsend extension can send the same response from the path directly.
+        stat_result = serve_path.stat()
+        response = FileResponse(serve_path, media_type=media_type, headers=response_headers, stat_result=stat_result)
+        if headers.get("if-none-match") == response.headers.get("etag"):
+            not_modified_headers = {
+                key: value for key, value in response.headers.items()
+                if key not in ("content-length", "content-type")
+            }
+            return Response(status_code=304, headers=not_modified_headers)
+        return response
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = precompress_static(sys.argv[1] if len(sys.argv) > 1 else STATIC_DIR)
+    print(f"Wrote {count} precompressed files")
@@ -0,0 +1,216 @@
+"""
+Server-side store of Spotify tokens.
+
+The OAuth callback saves the user's tokens in an `auth_sessions` row and
+hands the client an opaque session ID instead of the refresh token. Route
+handlers exchange that ID for an access token that is valid for at least
+TOKEN_REFRESH_MARGIN more seconds: a background task refreshes tokens
+before they get that close to expiry, and a request that still finds one
+expiring refreshes it inline. Either way Spotify never sees an expired
+token, so requests no longer fail with 401, refresh and retry. Every
+worker runs the background task; each session is claimed with the
+scheduler's conditional UPDATE, so only one of them refreshes it.
+
+Tokens are encrypted with Fernet. The key comes from TOKEN_ENCRYPTION_KEY;
+without it one is derived from SPOTIFY_CLIENT_SECRET, which works but ties
+stored tokens to that secret.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import secrets
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from .config import SESSION_ACTIVE_WINDOW, SESSION_MAX_IDLE, TOKEN_REFRESH_INTERVAL, TOKEN_REFRESH_MARGIN
+from .database import SessionLocal
+from .models import AuthSession, SpotifyAccount
+
+logger = logging.getLogger(__name__)
+
+_fernet = None
+# One refresh at a time per session in this process: a lock and its number of holders and
+# waiters, dropped when that reaches zero, so only sessions being refreshed have an entry
+_refresh_locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+def _cipher():
+    global _fernet
+    if _fernet is None:
+        from cryptography.fernet import Fernet
+
+        key = os.getenv("TOKEN_ENCRYPTION_KEY")
+        if not key:
+            secret = os.getenv("SPOTIFY_CLIENT_SECRET")
+            if not secret:
+                raise RuntimeError("TOKEN_ENCRYPTION_KEY or SPOTIFY_CLIENT_SECRET is required to store tokens")
+            logger.warning("TOKEN_ENCRYPTION_KEY is not set; deriving the token key from SPOTIFY_CLIENT_SECRET")
+            key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+        _fernet = Fernet(key)
+    return _fernet
+
+def encrypt(value: str) -> str:
+    return _cipher().encrypt(value.encode()).decode()
+
+def decrypt(value: str) -> str:
+    return _cipher().decrypt(value.encode()).decode()
+
+def _expires_at(token_info: Dict) -> datetime:
+    return datetime.utcnow() + timedelta(seconds=token_info.get("expires_in") or 3600)
+
+def _expiring(session: AuthSession, margin: float = TOKEN_REFRESH_MARGIN) -> bool:
+    return session.expires_at <= datetime.utcnow() + timedelta(seconds=margin)
+
+async def _refresh_access_token(refresh_token: str) -> Dict:
+    from .api.auth import get_auth_manager
+
+    token_info = await asyncio.to_thread(get_auth_manager().refresh_access_token, refresh_token)
+    if not token_info or "access_token" not in token_info:
+        raise RuntimeError("Spotify did not return an access token")
+    return token_info
+
+def save_account(db, user_id: str, refresh_token: str):
+    """Create or update the user's account with their latest refresh token; caller commits"""
+    account = db.query(SpotifyAccount).filter(SpotifyAccount.id == user_id).first()
+    if account is None:
+        db.add(SpotifyAccount(id=user_id, refresh_token=encrypt(refresh_token)))
+    else:
+        account.refresh_token = encrypt(refresh_token)
+
+def create_session(db, user_id: str, token_info: Dict) -> str:
+    """Store freshly issued tokens for a new session and return its ID"""
+    session_id = secrets.token_urlsafe(32)
+    save_account(db, user_id, token_info["refresh_token"])
+    db.add(AuthSession(
+        id=session_id,
+        user_id=user_id,
+        access_token=encrypt(token_info["access_token"]),
+        refresh_token=encrypt(token_info["refresh_token"]),
+        expires_at=_expires_at(token_info)
+    ))
+    db.commit()
+    return session_id
+
+def session_user_id(db, session_id: str) -> Optional[str]:
+    """Spotify user of a stored session, None for unknown sessions"""
+    return db.query(AuthSession.user_id).filter(AuthSession.id == session_id).scalar()
+
+def delete_session(db, session_id: str):
+    db.query(AuthSession).filter(AuthSession.id == session_id).delete()
+    db.commit()
+
+@asynccontextmanager
+async def _refresh_lock(session_id: str):
+    lock, users = _refresh_locks.get(session_id, (asyncio.Lock(), 0))
+    _refresh_locks[session_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _refresh_locks[session_id]
+        if users == 1:
+            del _refresh_locks[session_id]
+        else:
+            _refresh_locks[session_id] = (lock, users - 1)
+
+async def refresh_session(db, session: AuthSession, margin: float = TOKEN_REFRESH_MARGIN):
+    """Refresh a session's access token if it expires within `margin` seconds and nobody just did"""
+    async with _refresh_lock(session.id):
+        db.refresh(session)
+        if not _expiring(session, margin):
+            return
+        refresh_token = decrypt(session.refresh_token)
+        token_info = await _refresh_access_token(refresh_token)
+        session.access_token = encrypt(token_info["access_token"])
+        session.expires_at = _expires_at(token_info)
+        if token_info.get("refresh_token") and token_info["refresh_token"] != refresh_token:
+            # Spotify may rotate the refresh token
+            session.refresh_token = encrypt(token_info["refresh_token"])
+            save_account(db, session.user_id, token_info["refresh_token"])
+        db.commit()
+
+async def session_access_token(db, session_id: str) -> Optional[str]:
+    """Valid access token for a session, refreshing it first if it is about to expire"""
+    session = db.query(AuthSession).filter(AuthSession.id == session_id).first()
+    if session is None:
+        return None
+    if _expiring(session):
+        await refresh_session(db, session)
+    if session.last_used_at is None or session.last_used_at < datetime.utcnow() - timedelta(hours=1):
+        # Coarse, so that use is recorded without a write on every request
+        session.last_used_at = datetime.utcnow()
+        db.commit()
+    return decrypt(session.access_token)
+
+async def user_access_token(db, user_id: str) -> str:
+    """Valid access token for a user without a request, e.g. for background jobs"""
+    now = datetime.utcnow()
+    session = (
+        db.query(AuthSession)
+        .filter(AuthSession.user_id == user_id)
+        .filter(AuthSession.expires_at > now + timedelta(seconds=TOKEN_REFRESH_MARGIN))
+        .first()
+    )
+    if session is not None:
+        return decrypt(session.access_token)
+
+    account = db.query(SpotifyAccount).filter(SpotifyAccount.id == user_id).first()
+    if account is None:
+        raise RuntimeError(f"No stored Spotify account for user {user_id}")
+    refresh_token = decrypt(account.refresh_token)
+    token_info = await _refresh_access_token(refresh_token)
+    if token_info.get("refresh_token") and token_info["refresh_token"] != refresh_token:
+        account.refresh_token = encrypt(token_info["refresh_token"])
+        db.commit()
+    return token_info["access_token"]
+
+async def refresh_expiring_sessions() -> int:
+    """Refresh recently used sessions close to expiry and drop abandoned ones; returns how many were refreshed"""
+    from .scheduler import claim
+
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        db.query(AuthSession).filter(AuthSession.last_used_at < now - timedelta(seconds=SESSION_MAX_IDLE)).delete()
+        db.commit()
+
+        # One interval beyond the request margin, so requests never have to refresh inline.
+        # Idle sessions are left alone and refreshed on their next use instead.
+        margin = TOKEN_REFRESH_MARGIN + TOKEN_REFRESH_INTERVAL
+        expiring = (
+            db.query(AuthSession)
+            .filter(AuthSession.expires_at <= now + timedelta(seconds=margin))
+            .filter(AuthSession.last_used_at >= now - timedelta(seconds=SESSION_ACTIVE_WINDOW))
+            .all()
+        )
+        refreshed = 0
+        for session in expiring:
+            # Another worker's pass may have it; a claim left by a crashed worker lapses by the next pass
+            if not claim(db, session.id, datetime.utcnow(), model=AuthSession, ttl=TOKEN_REFRESH_INTERVAL):
+                continue
+            try:
+                await refresh_session(db, session, margin)
+                session.locked_until = None
+                db.commit()
+                refreshed += 1
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Could not refresh session for user {session.user_id}: {str(e)}")
+                if session.expires_at <= now:
+                    # Expired and not refreshable, e.g. access was revoked; the user has to log in again
+                    db.delete(session)
+                    db.commit()
+        return refreshed
+    finally:
+        db.close()
+
+async def run_token_refresher(interval: float = TOKEN_REFRESH_INTERVAL):
+    """Keep stored sessions refreshed ahead of expiry; started and cancelled by the app lifespan"""
+    while True:
+        try:
+            await refresh_expiring_sessions()
+        except Exception as e:
+            logger.error(f"Token refresh pass failed: {str(e)}")
+        await asyncio.sleep(interval)
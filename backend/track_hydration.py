@@ -0,0 +1,110 @@
+"""
+Batched hydration of stored track metadata.
+
+Track rows created from suggestions only know a name, artist and preview
+URL, and preview URLs go stale. `hydrate_tracks` collects the rows never
+hydrated or not refreshed within TRACK_REFRESH_AGE, fetches them with
+Spotify's multi-ID tracks endpoint (TRACK_HYDRATION_BATCH IDs per call,
+TRACK_HYDRATION_CONCURRENCY calls at a time under the shared rate limiter)
+and writes them back with executemany UPDATEs (one per row shape), so 10k
+tracks take 200 calls and a couple of statements.
+
+The scheduler runs it after each playlist refresh pass;
+POST /playlist/tracks/hydrate runs it on demand.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, or_, update
+
+from . import spotify_client
+from .config import TRACK_HYDRATION_BATCH, TRACK_HYDRATION_CONCURRENCY, TRACK_HYDRATION_LIMIT, TRACK_REFRESH_AGE
+from .models import Track
+
+logger = logging.getLogger(__name__)
+
+def tracks_needing_hydration(db, limit: int = TRACK_HYDRATION_LIMIT, now: Optional[datetime] = None) -> List:
+    """(id, spotify_id, meta_data) of tracks never hydrated or not refreshed lately, never-hydrated first"""
+    now = now or datetime.utcnow()
+    return (
+        db.query(Track.id, Track.spotify_id, Track.meta_data)
+        .filter(or_(Track.hydrated_at.is_(None), Track.hydrated_at < now - timedelta(seconds=TRACK_REFRESH_AGE)))
+        .order_by(Track.hydrated_at.is_not(None), Track.hydrated_at)
+        .limit(limit)
+        .all()
+    )
+
+async def fetch_tracks(sp, spotify_ids: List[str]) -> Dict[str, Optional[Dict]]:
+    """Spotify track objects by ID, None for IDs Spotify no longer knows"""
+    semaphore = asyncio.Semaphore(TRACK_HYDRATION_CONCURRENCY)
+
+    async def fetch_batch(batch: List[str]) -> List[Optional[Dict]]:
+        async with semaphore:
+            response = await spotify_client.call(sp.tracks, batch)
+        return response.get('tracks') or [None] * len(batch)
+
+    batches = [
+        spotify_ids[start:start + TRACK_HYDRATION_BATCH] for start in range(0, len(spotify_ids), TRACK_HYDRATION_BATCH)
+    ]
+    results = await asyncio.gather(*[fetch_batch(batch) for batch in batches])
+    return {
+        spotify_id: track
+        for batch, tracks in zip(batches, results)
+        for spotify_id, track in zip(batch, tracks)
+    }
+
+def hydrated_values(track_id: str, meta_data: Optional[Dict], track: Optional[Dict], now: datetime) -> Dict:
+    """Column values for one Track row from its Spotify track object"""
+    if track is None:
+        # Removed from Spotify: keep what we have, but don't ask again until the next refresh
+        return {
+            "_id": track_id,
+            "meta_data": {**(meta_data or {}), "unavailable": True},
+            "hydrated_at": now,
+            "updated_at": now
+        }
+    artists = [artist['name'] for artist in track.get('artists') or []]
+    return {
+        "_id": track_id,
+        "name": track['name'],
+        "artist": ", ".join(artists),
+        "album": (track.get('album') or {}).get('name'),
+        "duration_ms": track.get('duration_ms'),
+        "preview_url": track.get('preview_url'),
+        "meta_data": {
+            **(meta_data or {}),
+            "external_url": (track.get('external_urls') or {}).get('spotify'),
+            "artists": artists,
+            "popularity": track.get('popularity'),
+            "explicit": track.get('explicit'),
+            "unavailable": False
+        },
+        "hydrated_at": now,
+        "updated_at": now
+    }
+
+async def hydrate_tracks(sp, db, limit: int = TRACK_HYDRATION_LIMIT) -> Dict:
+    """Fill in or refresh up to `limit` tracks; returns how many were updated and how many are gone"""
+    rows = tracks_needing_hydration(db, limit)
+    if not rows:
+        return {"updated": 0, "unavailable": 0}
+
+    fetched = await fetch_tracks(sp, list(dict.fromkeys(row.spotify_id for row in rows)))
+    now = datetime.utcnow()
+    values = [hydrated_values(row.id, row.meta_data, fetched.get(row.spotify_id), now) for row in rows]
+    # One executemany UPDATE per shape of row (found on Spotify or not)
+    for columns in {tuple(sorted(value)) for value in values}:
+        batch = [value for value in values if tuple(sorted(value)) == columns]
+        db.execute(
+            update(Track.__table__)
+            .where(Track.__table__.c.id == bindparam("_id"))
+            .values({column: bindparam(column) for column in columns if column != "_id"}),
+            batch
+        )
+    db.commit()
+
+    unavailable = sum(1 for row in rows if fetched.get(row.spotify_id) is None)
+    logger.info(f"Hydrated {len(rows) - unavailable} tracks, {unavailable} no longer on Spotify")
+    return {"updated": len(rows) - unavailable, "unavailable": unavailable}
@@ -0,0 +1,190 @@
+"""
+In-process typeahead index over stored tracks and library genres.
+
+Words are indexed by prefix and trigram; tracks committed by this worker are
+added as they are written, and the index is rebuilt in the background.
+"""
+import asyncio
+import bisect
+import heapq
+import logging
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import TYPEAHEAD_PREFIX_LENGTH, TYPEAHEAD_REBUILD_INTERVAL
+from .database import SessionLocal
+from .library import load_library
+from .models import Track
+
+logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# Tracks rank above genres when both match equally well
+KIND_WEIGHT = {"track": 0, "genre": 1}
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return " ".join(_WORD_PATTERN.findall(text.lower()))
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TypeaheadIndex:
+    """
+    Prefix and trigram index over short labels; add() is incremental.
+
+    Prefix buckets are kept sorted by rank, so a search walks the most
+    selective bucket in order and stops at `limit` matches instead of
+    ranking every entry that shares a common prefix.
+    """
+
+    def __init__(self):
+        self.entries: List[Dict] = []
+        self._words: List[List[str]] = []
+        self._keys: Set[tuple] = set()
+        self._prefixes: Dict[str, List[tuple]] = defaultdict(list)
+        self._trigrams: Dict[str, Set[int]] = defaultdict(set)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry: Dict):
+        """Index an entry with a "kind" and a "label"; duplicates are ignored"""
+        key = (entry["kind"], entry.get("uri") or normalize(entry["label"]))
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        words = normalize(entry["label"]).split()
+        self._words.append(words)
+        # Tracks before genres, then shorter labels, then older entries
+        rank = (KIND_WEIGHT[entry["kind"]], len(words), entry_id)
+        prefixes = {word[:length] for word in words for length in range(1, min(len(word), TYPEAHEAD_PREFIX_LENGTH) + 1)}
+        for prefix in prefixes:
+            bisect.insort(self._prefixes[prefix], rank)
+        for word in words:
+            for gram in trigrams(word):
+                self._trigrams[gram].add(entry_id)
+
+    def _matches(self, entry_id: int, tokens: List[str]) -> bool:
+        # Every token must start a word of the entry; the last one may be incomplete
+        words = self._words[entry_id]
+        return all(any(word.startswith(token) for word in words) for token in tokens)
+
+    def _prefix_matches(self, tokens: List[str], limit: int) -> List[int]:
+        buckets = [self._prefixes.get(token[:TYPEAHEAD_PREFIX_LENGTH], []) for token in tokens]
+        matches = []
+        for rank in min(buckets, key=len):
+            if self._matches(rank[-1], tokens):
+                matches.append(rank[-1])
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def _trigram_matches(self, tokens: List[str], limit: int) -> List[int]:
+        # Typos and matches inside words: rank by the share of the query's trigrams an entry has
+        grams = set().union(*(trigrams(token) for token in tokens))
+        counts: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for entry_id in self._trigrams.get(gram, ()):
+                counts[entry_id] += 1
+        threshold = max(2, len(grams) // 2)
+        candidates = [entry_id for entry_id, count in counts.items() if count >= threshold]
+        return heapq.nlargest(limit, candidates, key=lambda entry_id: counts[entry_id])
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        tokens = normalize(query).split()
+        if not tokens:
+            return []
+        ranked = self._prefix_matches(tokens, limit)
+        if len(ranked) < limit:
+            ranked += [entry_id for entry_id in self._trigram_matches(tokens, limit) if entry_id not in ranked]
+        return [self.entries[entry_id] for entry_id in ranked[:limit]]
+
+def track_entry(track: Track) -> Dict:
+    return {
+        "kind": "track",
+        "label": f"{track.name} {track.artist}",
+        "name": track.name,
+        "artist": track.artist,
+        "uri": f"spotify:track:{track.spotify_id}",
+        "preview_url": track.preview_url
+    }
+
+def genre_entry(genre: Dict) -> Dict:
+    return {"kind": "genre", "label": genre["name"], "name": genre["name"], "category": genre.get("category")}
+
+_index: Optional[TypeaheadIndex] = None
+_built_at = 0.0
+_building: Optional[asyncio.Task] = None
+# Entries committed while a build runs, which its scan may have missed
+_added_during_build: List[Dict] = []
+
+def build_index() -> TypeaheadIndex:
+    index = TypeaheadIndex()
+    db = SessionLocal()
+    try:
+        rows = db.query(Track.name, Track.artist, Track.spotify_id, Track.preview_url).all()
+    finally:
+        db.close()
+    for row in rows:
+        index.add(track_entry(row))
+    try:
+        for genre in load_library().get("genres", []):
+            index.add(genre_entry(genre))
+    except OSError as e:
+        logger.warning(f"Typeahead index built without library genres: {str(e)}")
+    logger.info(f"Built typeahead index with {len(index)} entries")
+    return index
+
+async def _rebuild():
+    global _index, _built_at, _building
+    try:
+        _added_during_build.clear()
+        index = await asyncio.to_thread(build_index)
+        for entry in _added_during_build:
+            index.add(entry)
+        _index, _built_at = index, time.monotonic()
+    except Exception as e:
+        logger.error(f"Typeahead index build failed: {str(e)}")
+    finally:
+        _building = None
+
+async def get_index() -> TypeaheadIndex:
+    """The process-wide index; built on first use, then rebuilt in the background once it is old"""
+    global _building
+    if _building is None and (_index is None or time.monotonic() - _built_at > TYPEAHEAD_REBUILD_INTERVAL):
+        _building = asyncio.ensure_future(_rebuild())
+    if _index is None:
+        await asyncio.shield(_building)
+    return _index or TypeaheadIndex()
+
+def _add(entry: Dict):
+    if _index is not None:
+        _index.add(entry)
+    if _building is not None:
+        _added_during_build.append(entry)
+
+@event.listens_for(Session, "after_flush")
+def _collect_inserted_tracks(session, flush_context):
+    # Captured now: after the commit the instances are expired and reading them would query again
+    entries = [track_entry(obj) for obj in session.new if isinstance(obj, Track)]
+    if entries:
+        session.info.setdefault("typeahead_entries", []).extend(entries)
+
+@event.listens_for(Session, "after_commit")
+def _index_committed_tracks(session):
+    for entry in session.info.pop("typeahead_entries", ()):
+        _add(entry)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_tracks(session):
+    session.info.pop("typeahead_entries", None)
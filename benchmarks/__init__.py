@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for the backend.
+Run from the repository root, e.g. `python -m benchmarks.import_time`.
+"""
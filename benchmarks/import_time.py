@@ -0,0 +1,73 @@
+"""
+Measure the cold import cost of the ASGI app with `python -X importtime`.
+
+Exits non-zero when importing backend.main exceeds IMPORT_TIME_BUDGET_MS or
+pulls in any of the SDKs listed in LAZY_IMPORTS, so it can gate CI:
+
+    python -m benchmarks.import_time [--runs 5] [--budget-ms 1000]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from backend.config import IMPORT_TIME_BUDGET_MS, LAZY_IMPORTS
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+TARGET = "backend.main"
+
+def measure_import(target: str = TARGET):
+    """Import target in a fresh interpreter and return (total_ms, imported_modules)"""
+    env = {**os.environ, "PYTHONPATH": str(REPO_ROOT)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {target} failed:\n{result.stderr}")
+
+    total_us = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # Top-level entries have no indentation; their cumulative times add up to the total
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=int, default=IMPORT_TIME_BUDGET_MS)
+    args = parser.parse_args()
+
+    timings = []
+    modules = set()
+    for _ in range(args.runs):
+        total_ms, modules = measure_import()
+        timings.append(total_ms)
+
+    median_ms = statistics.median(timings)
+    print(f"import {TARGET}: median {median_ms:.1f} ms, min {min(timings):.1f} ms over {args.runs} runs "
+          f"(budget {args.budget_ms} ms)")
+
+    failed = False
+    eager = sorted(m for m in LAZY_IMPORTS if m in modules)
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"FAIL: import time over budget by {median_ms - args.budget_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
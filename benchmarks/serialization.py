@@ -0,0 +1,97 @@
+"""
+Compare FastAPI's default response path with the orjson fast path.
+
+Default: response_model validation of ORM rows (from_attributes), Pydantic
+serialization and JSONResponse rendering, or jsonable_encoder for plain
+dicts. Fast: `to_dict()` plus backend.responses.json_response.
+
+    python -m benchmarks.serialization [--sizes 1000 10000 100000] [--repeat 3]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from backend.api.playlist import TrackResponse
+from backend.models import Track
+from backend.responses import json_response
+
+def make_tracks(count: int) -> List[Track]:
+    now = datetime.utcnow()
+    return [
+        Track(
+            id=str(uuid.uuid4()),
+            spotify_id=f"spotify{i:08d}",
+            name=f"Track {i}",
+            artist=f"Artist {i % 500}",
+            album=f"Album {i % 2000}",
+            duration_ms=180000 + i,
+            preview_url=f"https://p.scdn.co/mp3-preview/{i:08d}",
+            meta_data={"popularity": i % 100, "explicit": bool(i % 2)},
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(count)
+    ]
+
+def make_suggestions(count: int) -> List[dict]:
+    return [
+        {
+            "track": f"Track {i}",
+            "artist": f"Artist {i % 500}",
+            "reason": "The polished production matches the brand's contemporary identity.",
+            "spotify_data": {"uri": f"spotify:track:{i:08d}", "preview_url": None},
+        }
+        for i in range(count)
+    ]
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    field = create_response_field(name="response", type_=List[TrackResponse])
+
+    def default_tracks(rows):
+        content = asyncio.run(serialize_response(field=field, response_content=rows))
+        return JSONResponse(content).body
+
+    def fast_tracks(rows):
+        return json_response([row.to_dict() for row in rows]).body
+
+    def default_suggestions(items):
+        return JSONResponse(jsonable_encoder({"suggestions": items})).body
+
+    def fast_suggestions(items):
+        return json_response({"suggestions": items}).body
+
+    print(f"{'payload':<12}{'items':>8}{'default ms':>12}{'fast ms':>10}{'speedup':>9}")
+    for size in args.sizes:
+        rows = make_tracks(size)
+        items = make_suggestions(size)
+        for label, default, fast, data in (
+            ("tracks", default_tracks, fast_tracks, rows),
+            ("suggestions", default_suggestions, fast_suggestions, items),
+        ):
+            default_ms = best_of(args.repeat, lambda: default(data))
+            fast_ms = best_of(args.repeat, lambda: fast(data))
+            print(f"{label:<12}{size:>8}{default_ms:>12.1f}{fast_ms:>10.1f}{default_ms / fast_ms:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,10 @@ class ApiClientClass {
 
     this.client.interceptors.request.use(
       (config) => {
+        const sessionId = localStorage.getItem('spotify_session');
+        if (sessionId) {
+          config.headers['X-Session-ID'] = sessionId;
+        }
         const token = localStorage.getItem('spotify_token');
         if (token) {
           const tokenInfo: TokenInfo = JSON.parse(token);
@@ -45,6 +45,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
   const logout = useCallback(() => {
     localStorage.removeItem('spotify_token');
+    localStorage.removeItem('spotify_session');
     setToken(null);
     navigate('/login');
   }, [navigate]);
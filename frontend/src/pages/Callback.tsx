@@ -35,7 +35,10 @@ const Callback: React.FC = () => {
           throw new Error('No access token received');
         }
 
-        // Store the token
+        // Store the token; the session lets the server keep it refreshed
+        if (data.session_id) {
+          localStorage.setItem('spotify_session', data.session_id);
+        }
         setToken(data.access_token);
         showToast('Successfully connected with Spotify', 'success');
 
@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+# Production serving mode: several uvicorn workers behind one gunicorn master.
+# Worker processes share the SQLite-backed application cache (see backend/cache.py).
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("WEB_LOG_LEVEL", "info")
@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+# Settings are read when backend.config is imported, so they are set before any test imports the app
+_db_dir = tempfile.mkdtemp(prefix="playlist-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["SCHEDULER_ENABLED"] = "false"
+os.environ["QUERY_COUNT_HEADER"] = "true"
+os.environ["ANTHROPIC_API_KEY"] = ""
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture(scope="session")
+def client():
+    from backend.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def fresh_quotas():
+    """Empty every admission quota, so tests don't spend each other's requests"""
+    from backend.admission import admission_controls
+    from backend.config import ADMISSION_LIMITS
+
+    quotas = [admission_controls(name)[1] for name in ADMISSION_LIMITS]
+    for quota in quotas:
+        quota._counts.clear()
+    yield
+    for quota in quotas:
+        quota._counts.clear()
@@ -0,0 +1,63 @@
+"""Admission gates and per-caller quotas on the expensive brand endpoints"""
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from backend.admission import AdmissionGate
+from backend.cache import cache_key
+from backend.config import ADMISSION_LIMITS
+from backend.playlist_builder import token_cache
+
+BRAND_PROFILE_QUOTA = ADMISSION_LIMITS["brand-profile"]["per_user"]
+
+def test_rotating_unverified_credentials_share_the_address_quota(client, fresh_quotas):
+    statuses = []
+    for _ in range(BRAND_PROFILE_QUOTA + 1):
+        headers = {"Authorization": f"Bearer {uuid.uuid4()}", "X-Session-ID": str(uuid.uuid4())}
+        # No brand name: admitted requests fail fast with 400
+        statuses.append(client.post("/brands", json={}, headers=headers).status_code)
+    assert statuses[:-1] == [400] * BRAND_PROFILE_QUOTA
+    assert statuses[-1] == 429
+
+def test_confirmed_tokens_are_counted_per_user(client, fresh_quotas):
+    tokens = [str(uuid.uuid4()) for _ in range(BRAND_PROFILE_QUOTA + 1)]
+    for token in tokens:
+        token_cache.set(cache_key(token), {"id": "quota-user"})
+    statuses = [
+        client.post("/brands", json={}, headers={"Authorization": f"Bearer {token}"}).status_code for token in tokens
+    ]
+    assert statuses[-1] == 429
+    # Another user still has their own quota
+    token_cache.set(cache_key("other"), {"id": "other-user"})
+    assert client.post("/brands", json={}, headers={"Authorization": "Bearer other"}).status_code == 400
+
+def test_gate_sheds_beyond_its_queue():
+    async def scenario():
+        gate = AdmissionGate("test", concurrency=1, queue_size=1, queue_timeout=0.05)
+        await gate.acquire()
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            await gate.acquire()
+        assert rejected.value.status_code == 503
+        assert rejected.value.headers["Retry-After"]
+        gate.release()
+        await waiter
+        gate.release()
+
+    asyncio.run(scenario())
+
+def test_gate_rejects_after_queue_timeout():
+    async def scenario():
+        gate = AdmissionGate("test", concurrency=1, queue_size=5, queue_timeout=0.01)
+        async with gate.slot():
+            with pytest.raises(HTTPException):
+                await gate.acquire()
+        assert gate.waiting == 0
+        # The slot was given back
+        async with gate.slot():
+            pass
+
+    asyncio.run(scenario())
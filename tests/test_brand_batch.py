@@ -0,0 +1,56 @@
+"""Batch onboarding skips existing brands and reports each generation"""
+import importlib
+import json
+import uuid
+
+import pytest
+
+from backend.database import SessionLocal
+from backend.models import BrandProfile
+
+brands_api = importlib.import_module("backend.api.brands")
+
+@pytest.fixture
+def generated(client, fresh_quotas, monkeypatch):
+    names = []
+
+    async def build_brand_profile(name):
+        names.append(name)
+        return {"brand": name, "description": f"{name} profile", "status": "pending_approval"}, False
+
+    monkeypatch.setattr(brands_api, "build_brand_profile", build_brand_profile)
+    return names
+
+def stored(brand_ids):
+    db = SessionLocal()
+    try:
+        return {brand.id for brand in db.query(BrandProfile).filter(BrandProfile.id.in_(brand_ids))}
+    finally:
+        db.close()
+
+def test_batch_creates_new_brands_once(client, generated):
+    suffix = uuid.uuid4().hex[:8]
+    first, second = f"Batch {suffix} One", f"Batch {suffix} Two"
+    response = client.post("/brands/batch", json={"brands": ["Gucci", first, first.lower(), second, " "]})
+    assert response.status_code == 200
+    summary = response.json()
+    assert (summary["created"], summary["skipped"], summary["failed"], summary["rejected"]) == (2, 1, 0, 0)
+    assert sorted(generated) == sorted([first, second])
+    statuses = {result["brand_id"]: result["status"] for result in summary["results"]}
+    assert statuses["gucci"] == "exists"
+    assert stored([brands_api.brand_id_for(first), brands_api.brand_id_for(second)]) == {
+        brands_api.brand_id_for(first), brands_api.brand_id_for(second)
+    }
+
+def test_batch_streams_an_event_per_brand_then_the_summary(client, generated):
+    names = [f"Streamed {uuid.uuid4().hex[:8]}" for _ in range(3)]
+    response = client.post("/brands/batch?stream=true", json={"brands": names})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["generated"] * 3 + ["summary"]
+    assert {event["brand"] for event in events[:3]} == set(names)
+    assert events[-1]["created"] == 3
+
+def test_batch_requires_brand_names(client, generated):
+    assert client.post("/brands/batch", json={"brands": []}).status_code == 422
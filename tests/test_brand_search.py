@@ -0,0 +1,60 @@
+"""Brand full-text search follows profile writes and ranks name matches first"""
+import uuid
+
+import pytest
+
+from backend.database import SessionLocal
+from backend.models import BrandProfile
+
+@pytest.fixture
+def word(client):
+    # A term no other test's brand contains
+    return f"zq{uuid.uuid4().hex[:10]}"
+
+def add_brands(*brands):
+    db = SessionLocal()
+    db.add_all([BrandProfile(id=brand_id, name=name, data=data) for brand_id, name, data in brands])
+    db.commit()
+    db.close()
+
+def search(client, q, **params):
+    response = client.get("/brands/search", params={"q": q, **params})
+    assert response.status_code == 200
+    return response.json()
+
+def test_name_matches_rank_first(client, word):
+    add_brands(
+        (f"{word}-described", "Described", {"description": f"Mentions {word} twice: {word}"}),
+        (f"{word}-named", f"{word} House", {"description": "Tailoring"}),
+    )
+    found = search(client, word)
+    assert found["total"] == 2
+    assert [brand["id"] for brand in found["brands"]] == [f"{word}-named", f"{word}-described"]
+
+    page = search(client, word, limit=1, offset=1)
+    assert [brand["id"] for brand in page["brands"]] == [f"{word}-described"]
+
+def test_words_are_stemmed_and_anded(client, word):
+    add_brands((f"{word}-stemmed", "Stemmed", {"description": f"{word} tailoring for runners"}))
+    assert search(client, f"{word} tailored")["total"] == 1
+    assert search(client, f"{word} sneakers")["total"] == 0
+
+def test_query_syntax_is_not_interpreted(client, word):
+    add_brands((f"{word}-quoted", "Quoted", {"description": word}))
+    assert search(client, f'"{word}" OR NEAR(')["total"] == 0
+    assert search(client, f'{word}*')["total"] == 1
+    assert search(client, "***")["total"] == 0
+
+def test_updates_and_deletes_reach_the_index(client, word):
+    brand_id = f"{word}-edited"
+    add_brands((brand_id, "Edited", {"description": "Before"}))
+    db = SessionLocal()
+    brand = db.get(BrandProfile, brand_id)
+    brand.data = {"description": word}
+    db.commit()
+    assert [brand["id"] for brand in search(client, word)["brands"]] == [brand_id]
+
+    db.delete(db.get(BrandProfile, brand_id))
+    db.commit()
+    db.close()
+    assert search(client, word)["total"] == 0
@@ -0,0 +1,42 @@
+"""The SQLite cache shared by worker processes"""
+import asyncio
+import time
+
+from backend.cache import SQLiteCache
+
+def test_values_round_trip_through_the_file(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteCache("roundtrip", path=path)
+
+    async def scenario():
+        await cache.aset("key", {"tracks": [1, 2]})
+        assert await cache.aget("key") == {"tracks": [1, 2]}
+        # Another worker opens the same file
+        assert await SQLiteCache("roundtrip", path=path).aget("key") == {"tracks": [1, 2]}
+        assert await SQLiteCache("other", path=path).aget("key", "missing") == "missing"
+        await cache.adelete("key")
+        assert await cache.aget("key") is None
+
+    asyncio.run(scenario())
+
+def test_expired_entries_are_not_served(tmp_path, monkeypatch):
+    cache = SQLiteCache("expiry", default_ttl=10, path=str(tmp_path / "cache.db"))
+    cache.set("key", "value")
+    monkeypatch.setattr(time, "time", lambda now=time.time(): now + 11)
+    assert cache.get("key") is None
+
+def test_add_stores_once_across_workers(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.db")
+    worker, other_worker = SQLiteCache("claims", path=path), SQLiteCache("claims", path=path)
+
+    async def scenario():
+        assert await worker.aadd("claim", "worker", ttl=10)
+        assert not await other_worker.aadd("claim", "other", ttl=10)
+        assert await other_worker.aget("claim") == "worker"
+
+    asyncio.run(scenario())
+
+    # An expired claim is taken over
+    monkeypatch.setattr(time, "time", lambda now=time.time(): now + 11)
+    assert other_worker.add("claim", "other", ttl=10)
+    assert worker.get("claim") == "other"
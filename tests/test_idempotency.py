@@ -0,0 +1,52 @@
+"""An Idempotency-Key replays its result only for the request that stored it"""
+import importlib
+
+import pytest
+
+from backend.cache import cache_key
+from backend.database import SessionLocal
+from backend.models import BrandProfile
+from backend.playlist_builder import token_cache
+
+# backend.api re-exports the router as "brands", shadowing the module
+brands_api = importlib.import_module("backend.api.brands")
+
+@pytest.fixture
+def playlist_runs(client, fresh_quotas, monkeypatch):
+    db = SessionLocal()
+    for brand_id in ("idem-one", "idem-two"):
+        if not db.get(BrandProfile, brand_id):
+            db.add(BrandProfile(id=brand_id, name=brand_id, data={"status": "approved"}))
+    db.commit()
+    db.close()
+    token_cache.set(cache_key("idem-token"), {"id": "idem-user"})
+
+    runs = []
+
+    async def build_brand_playlist(sp, user_id, brand_id, brand_name, suggestions, progress=None, top_up_profile=None):
+        runs.append(brand_id)
+        return {"playlist_id": f"playlist-{len(runs)}", "tracks_added": len(suggestions)}
+
+    monkeypatch.setattr(brands_api, "build_brand_playlist", build_brand_playlist)
+    return runs
+
+def create(client, key, brand_id="idem-one", track="Song"):
+    return client.post(
+        "/brands/create-playlist",
+        json={"brand_id": brand_id, "suggestions": [{"track": track, "artist": "Artist"}]},
+        headers={"Authorization": "Bearer idem-token", "Idempotency-Key": key},
+    )
+
+def test_same_request_is_replayed(client, playlist_runs):
+    first = create(client, "replayed")
+    second = create(client, "replayed")
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert playlist_runs == ["idem-one"]
+
+def test_key_reused_with_another_body_is_rejected(client, playlist_runs):
+    assert create(client, "reused", track="Reused").status_code == 200
+    assert create(client, "reused", track="Another song").status_code == 422
+    assert create(client, "reused", brand_id="idem-two", track="Reused").status_code == 422
+    assert playlist_runs == ["idem-one"]
@@ -0,0 +1,63 @@
+"""The LLM circuit breaker and the per-call deadline"""
+import asyncio
+
+import httpx
+import pytest
+from anthropic import APITimeoutError
+
+from backend import llm
+from backend.llm import CircuitBreaker, LLMUnavailableError
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, "monotonic", lambda: now[0])
+    return now
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock[0] += 60
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed trial reopens the circuit for another reset_timeout
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock[0] += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+class SlowCompletions:
+    def __init__(self):
+        self.timeouts = []
+
+    def create(self, timeout, **kwargs):
+        self.timeouts.append(timeout)
+        raise APITimeoutError(request=httpx.Request("POST", "https://api.anthropic.com/v1/complete"))
+
+class SlowClient:
+    def __init__(self):
+        self.completions = SlowCompletions()
+
+def test_deadline_is_set_on_the_request(monkeypatch):
+    client = SlowClient()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    monkeypatch.setattr(llm, "_get_client", lambda: client)
+    monkeypatch.setattr(llm, "llm_breaker", breaker)
+
+    with pytest.raises(LLMUnavailableError, match="deadline"):
+        asyncio.run(llm.complete("prompt", max_tokens=10, timeout=1.5))
+    assert client.completions.timeouts == [1.5]
+    assert breaker.failures == 1
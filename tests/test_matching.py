@@ -0,0 +1,26 @@
+"""Scoring of Spotify search candidates against suggested songs"""
+import pytest
+
+from backend.matching import best_match, normalize_title
+
+def candidate(name, artist):
+    return {"name": name, "artists": [{"name": artist}]}
+
+@pytest.mark.parametrize("title, expected", [
+    ("Stay With Me", "stay with me"),
+    ("Song (with Khalid)", "song"),
+    ("Song [feat. B]", "song"),
+    ("Song ft. B", "song"),
+    ("Song - Remastered 2011", "song"),
+])
+def test_normalize_title(title, expected):
+    assert normalize_title(title) == expected
+
+def test_exact_title_by_another_artist_is_not_a_match():
+    match, _ = best_match("Hello", "Adele", [candidate("Hello", "Lionel Richie")])
+    assert match is None
+
+def test_right_artist_wins_over_namesake():
+    match, score = best_match("Hello", "Adele", [candidate("Hello", "Lionel Richie"), candidate("Hello", "Adele")])
+    assert match["artists"][0]["name"] == "Adele"
+    assert score == 1.0
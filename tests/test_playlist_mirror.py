@@ -0,0 +1,56 @@
+"""Mirroring stays correct under concurrent workers and doesn't repeat for empty libraries"""
+import importlib
+import uuid
+
+from backend import spotify_client
+from backend.cache import cache_key
+from backend.database import SessionLocal
+from backend.models import Playlist
+from backend.playlist_builder import token_cache
+from backend.playlist_mirror import _add_new
+
+def test_rows_stored_meanwhile_are_read_back(client):
+    raced_id, new_id = f"raced-{uuid.uuid4()}", f"new-{uuid.uuid4()}"
+    db, other_worker = SessionLocal(), SessionLocal()
+    try:
+        # This session looked the playlists up before the other worker stored one of them
+        assert db.query(Playlist).filter(Playlist.spotify_id.in_([raced_id, new_id])).all() == []
+        winner_id = str(uuid.uuid4())
+        other_worker.add(Playlist(id=winner_id, spotify_id=raced_id, name="Stored first"))
+        other_worker.commit()
+
+        rows = _add_new(db, Playlist, {
+            spotify_id: Playlist(id=str(uuid.uuid4()), spotify_id=spotify_id, name="Mirrored")
+            for spotify_id in (raced_id, new_id)
+        })
+        db.commit()
+
+        assert rows[raced_id].id == winner_id
+        assert rows[raced_id].name == "Stored first"
+        assert db.query(Playlist).filter(Playlist.spotify_id == new_id).one().id == rows[new_id].id
+    finally:
+        db.close()
+        other_worker.close()
+
+class EmptyLibrary:
+    def current_user_playlists(self, limit, offset):
+        return {"total": 0, "items": []}
+
+def test_empty_library_is_mirrored_once(client, monkeypatch):
+    playlist_api = importlib.import_module("backend.api.playlist")
+    token_cache.set(cache_key("empty-library-token"), {"id": f"empty-{uuid.uuid4()}"})
+    monkeypatch.setattr(spotify_client, "get_client", lambda token: EmptyLibrary())
+    mirrors = []
+    sync_user_library = playlist_api.sync_user_library
+
+    async def counted_sync(token, user_id):
+        mirrors.append(user_id)
+        return await sync_user_library(token, user_id)
+
+    monkeypatch.setattr(playlist_api, "sync_user_library", counted_sync)
+    for _ in range(2):
+        response = client.get("/playlist/user", headers={"Authorization": "Bearer empty-library-token"})
+        assert response.status_code == 200
+        assert response.json()["playlists"] == []
+        assert response.json()["synced_at"] is not None
+    assert len(mirrors) == 1
@@ -0,0 +1,26 @@
+"""Brand playlist routes never expose playlists mirrored from users' libraries"""
+import uuid
+
+from backend.database import SessionLocal
+from backend.models import Playlist
+
+def test_mirrored_playlists_are_not_brand_playlists(client):
+    mirrored_id, brand_playlist_id = str(uuid.uuid4()), str(uuid.uuid4())
+    db = SessionLocal()
+    db.add_all([
+        Playlist(id=mirrored_id, spotify_id=f"mirrored-{mirrored_id}", name="Private mix"),
+        Playlist(id=brand_playlist_id, brand_id="gucci", name="Gucci Brand Playlist"),
+    ])
+    db.commit()
+    db.close()
+
+    listed = [playlist["id"] for playlist in client.get("/playlist/playlists/").json()]
+    assert brand_playlist_id in listed
+    assert mirrored_id not in listed
+    assert client.get(f"/playlist/playlists/{brand_playlist_id}").status_code == 200
+    assert client.get(f"/playlist/playlists/{mirrored_id}").status_code == 404
+    assert client.get(f"/playlist/playlists/{mirrored_id}/tracks").status_code == 404
+    assert client.delete(f"/playlist/playlists/{mirrored_id}").status_code == 404
+
+def test_user_playlist_tracks_require_a_token(client):
+    assert client.get("/playlist/user/anything/tracks").status_code == 401
@@ -0,0 +1,20 @@
+"""The hot read endpoints stay within their configured query budgets"""
+import pytest
+
+from backend.query_budget import assert_max_queries, get_query_budget
+
+@pytest.mark.parametrize("route, url", [
+    ("GET /brands", "/brands"),
+    ("GET /brands", "/brands?include_suggestions=true"),
+    ("GET /brands/{brand_id}", "/brands/gucci"),
+    ("GET /brands/{brand_id}", "/brands/gucci?include_suggestions=true"),
+    ("GET /brands/search", "/brands/search?q=luxury"),
+    ("GET /playlist/playlists/", "/playlist/playlists/"),
+])
+def test_hot_endpoint_within_budget(client, route, url):
+    response = assert_max_queries(client, "GET", url, get_query_budget(route))
+    assert response.status_code == 200
+
+def test_cached_brand_read_issues_no_queries(client):
+    client.get("/brands/gucci")
+    assert_max_queries(client, "GET", "/brands/gucci", 0)
@@ -0,0 +1,32 @@
+"""Track search serves shared cached results only to verified callers"""
+import pytest
+from spotipy import SpotifyException
+
+from backend import spotify_client
+from backend.api.search import search_cache
+from backend.cache import cache_key
+from backend.playlist_builder import token_cache
+
+class RejectingSpotify:
+    def current_user(self):
+        raise SpotifyException(401, -1, "The access token expired")
+
+@pytest.fixture
+def cached_search(monkeypatch):
+    monkeypatch.setattr(spotify_client, "get_client", lambda token: RejectingSpotify())
+    search_cache.set("cached query", [{"id": "t1", "name": "Cached"}])
+    yield "cached query"
+    search_cache.delete("cached query")
+
+def test_bad_token_gets_401_not_cached_results(client, cached_search):
+    response = client.get("/search/tracks", params={"q": cached_search}, headers={"Authorization": "Bearer made-up"})
+    assert response.status_code == 401
+
+def test_missing_credentials_get_401(client, cached_search):
+    assert client.get("/search/tracks", params={"q": cached_search}).status_code == 401
+
+def test_confirmed_token_gets_cached_results(client, cached_search):
+    token_cache.set(cache_key("confirmed"), {"id": "search-user"})
+    response = client.get("/search/tracks", params={"q": cached_search}, headers={"Authorization": "Bearer confirmed"})
+    assert response.status_code == 200
+    assert response.json()["tracks"][0]["id"] == "t1"
@@ -0,0 +1,53 @@
+"""Single-flight runs an operation once per key, also across workers"""
+import asyncio
+import uuid
+
+from backend.single_flight import SingleFlight
+
+def flights():
+    # Two instances on one namespace share its caches, as two workers share the cache file
+    namespace = f"flight_{uuid.uuid4().hex}"
+    return [SingleFlight(namespace, claim_ttl=5, result_ttl=5, poll_interval=0.01) for _ in range(2)]
+
+def test_concurrent_callers_share_one_run():
+    worker, other_worker = flights()
+    runs = []
+
+    async def operation():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return {"playlist_id": "p1"}
+
+    async def scenario():
+        return await asyncio.gather(
+            worker.run("key", operation), worker.run("key", operation), other_worker.run("key", operation)
+        )
+
+    results = asyncio.run(scenario())
+    assert runs == [1]
+    assert [result for result, _ in results] == [{"playlist_id": "p1"}] * 3
+    assert [shared for _, shared in results[:2]] == [False, True]
+
+def test_failed_run_is_not_kept():
+    worker, other_worker = flights()
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.02)
+        raise RuntimeError("Spotify is down")
+
+    async def succeeding():
+        return {"playlist_id": "p2"}
+
+    async def scenario():
+        first, second = await asyncio.gather(
+            worker.run("key", failing), other_worker.run("key", succeeding), return_exceptions=True
+        )
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    # The waiting worker saw the claim released without a result and ran the operation itself
+    assert second == ({"playlist_id": "p2"}, False)
+    assert attempts == [1]
@@ -0,0 +1,73 @@
+"""Stored Spotify tokens are encrypted at rest and refreshed before they expire"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from cryptography.fernet import Fernet
+
+from backend import token_store
+from backend.database import SessionLocal
+from backend.models import AuthSession, SpotifyAccount
+
+@pytest.fixture
+def store(client, monkeypatch):
+    monkeypatch.setenv("TOKEN_ENCRYPTION_KEY", Fernet.generate_key().decode())
+    monkeypatch.setattr(token_store, "_fernet", None)
+    refreshes = []
+
+    async def refresh_access_token(refresh_token):
+        refreshes.append(refresh_token)
+        await asyncio.sleep(0.01)
+        return {"access_token": f"access-{len(refreshes)}", "refresh_token": "rotated", "expires_in": 3600}
+
+    monkeypatch.setattr(token_store, "_refresh_access_token", refresh_access_token)
+    db = SessionLocal()
+    yield db, refreshes
+    db.close()
+    token_store._fernet = None
+
+def new_session(db, expires_in=3600):
+    user_id = f"user-{uuid.uuid4()}"
+    session_id = token_store.create_session(
+        db, user_id, {"access_token": "issued", "refresh_token": "original", "expires_in": expires_in}
+    )
+    return session_id, user_id
+
+def test_tokens_are_encrypted_at_rest(store):
+    db, refreshes = store
+    session_id, user_id = new_session(db)
+    session = db.get(AuthSession, session_id)
+    assert "issued" not in session.access_token
+    assert "original" not in session.refresh_token
+    assert "original" not in db.get(SpotifyAccount, user_id).refresh_token
+    assert asyncio.run(token_store.session_access_token(db, session_id)) == "issued"
+    assert refreshes == []
+
+def test_expiring_token_is_refreshed_once(store):
+    db, refreshes = store
+    session_id, user_id = new_session(db, expires_in=60)
+
+    async def concurrent_requests():
+        return await asyncio.gather(*[token_store.session_access_token(db, session_id) for _ in range(3)])
+
+    assert asyncio.run(concurrent_requests()) == ["access-1"] * 3
+    assert refreshes == ["original"]
+    # The rotated refresh token replaces the stored one for the session and the account
+    db.expire_all()
+    assert token_store.decrypt(db.get(AuthSession, session_id).refresh_token) == "rotated"
+    assert token_store.decrypt(db.get(SpotifyAccount, user_id).refresh_token) == "rotated"
+
+def test_background_pass_refreshes_active_sessions(store):
+    db, refreshes = store
+    active_id, _ = new_session(db, expires_in=60)
+    idle_id, _ = new_session(db, expires_in=60)
+    db.get(AuthSession, idle_id).last_used_at = datetime.utcnow() - timedelta(days=1)
+    db.commit()
+
+    assert asyncio.run(token_store.refresh_expiring_sessions()) >= 1
+    db.expire_all()
+    active, idle = db.get(AuthSession, active_id), db.get(AuthSession, idle_id)
+    assert token_store.decrypt(active.access_token).startswith("access-")
+    assert active.locked_until is None
+    assert token_store.decrypt(idle.access_token) == "issued"
@@ -0,0 +1,64 @@
+"""Track hydration fetches in batches and marks tracks Spotify no longer has"""
+import asyncio
+import uuid
+
+from backend.config import TRACK_HYDRATION_BATCH
+from backend.database import SessionLocal
+from backend.models import Track
+from backend.track_hydration import hydrate_tracks
+
+class FakeSpotify:
+    def __init__(self, gone):
+        self.gone = gone
+        self.batches = []
+
+    def tracks(self, spotify_ids):
+        self.batches.append(list(spotify_ids))
+        return {"tracks": [
+            None if spotify_id in self.gone else {
+                "id": spotify_id,
+                "name": f"Hydrated {spotify_id}",
+                "artists": [{"name": "Artist"}],
+                "album": {"name": "Album"},
+                "duration_ms": 180000,
+                "preview_url": None,
+                "external_urls": {"spotify": f"https://open.spotify.com/track/{spotify_id}"},
+                "popularity": 50,
+                "explicit": False
+            }
+            for spotify_id in spotify_ids
+        ]}
+
+def test_tracks_are_hydrated_in_batches(client):
+    spotify_ids = [f"hydrate-{uuid.uuid4().hex}" for _ in range(TRACK_HYDRATION_BATCH * 2 + 5)]
+    gone = spotify_ids[-1]
+    db = SessionLocal()
+    try:
+        db.add_all([
+            Track(spotify_id=spotify_id, name="Stub", artist="Stub", meta_data={"external_url": None})
+            for spotify_id in spotify_ids
+        ])
+        db.commit()
+
+        sp = FakeSpotify(gone={gone})
+        result = asyncio.run(hydrate_tracks(sp, db, limit=10_000))
+
+        assert all(len(batch) <= TRACK_HYDRATION_BATCH for batch in sp.batches)
+        assert set(spotify_ids) <= {spotify_id for batch in sp.batches for spotify_id in batch}
+        assert result["unavailable"] >= 1
+
+        db.expire_all()
+        tracks = {track.spotify_id: track for track in db.query(Track).filter(Track.spotify_id.in_(spotify_ids))}
+        hydrated = tracks[spotify_ids[0]]
+        assert hydrated.name == f"Hydrated {spotify_ids[0]}"
+        assert hydrated.album == "Album"
+        assert hydrated.meta_data["unavailable"] is False
+        assert hydrated.hydrated_at is not None
+
+        # Kept as stored, but marked and not asked for again until the next refresh
+        removed = tracks[gone]
+        assert removed.name == "Stub"
+        assert removed.meta_data == {"external_url": None, "unavailable": True}
+        assert removed.hydrated_at is not None
+    finally:
+        db.close()
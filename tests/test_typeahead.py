@@ -0,0 +1,52 @@
+"""Typeahead matches word prefixes, tolerates typos and picks up committed tracks"""
+import asyncio
+import uuid
+
+from backend import typeahead
+from backend.database import SessionLocal
+from backend.models import Track
+from backend.typeahead import TypeaheadIndex
+
+def labels(results):
+    return [entry["label"] for entry in results]
+
+def sample_index():
+    index = TypeaheadIndex()
+    index.add({"kind": "genre", "label": "Deep House"})
+    index.add({"kind": "track", "label": "House of Cards Radiohead", "uri": "spotify:track:1"})
+    index.add({"kind": "track", "label": "Houses Jimi Hendrix", "uri": "spotify:track:2"})
+    index.add({"kind": "track", "label": "Café del Mar Energy 52", "uri": "spotify:track:3"})
+    return index
+
+def test_every_word_must_start_with_a_query_token():
+    index = sample_index()
+    assert labels(index.search("hou")) == ["Houses Jimi Hendrix", "House of Cards Radiohead", "Deep House"]
+    assert labels(index.search("radiohead hou")) == ["House of Cards Radiohead"]
+    assert labels(index.search("cafe"))[0] == "Café del Mar Energy 52"
+    assert index.search("  ") == []
+
+def test_limit_and_duplicates():
+    index = sample_index()
+    index.add({"kind": "track", "label": "House of Cards (remaster)", "uri": "spotify:track:1"})
+    index.add({"kind": "genre", "label": "deep house"})
+    assert len(index) == 4
+    assert len(index.search("hou", limit=2)) == 2
+
+def test_typos_fall_back_to_trigrams():
+    assert labels(sample_index().search("radiohaed"))[0] == "House of Cards Radiohead"
+
+def test_committed_tracks_are_indexed(client):
+    asyncio.run(typeahead.get_index())
+    word = f"zq{uuid.uuid4().hex[:8]}"
+    db = SessionLocal()
+    try:
+        db.add(Track(spotify_id=f"{word}-kept", name=f"{word} Kept", artist="Artist"))
+        db.commit()
+        db.add(Track(spotify_id=f"{word}-dropped", name=f"{word} Dropped", artist="Artist"))
+        db.flush()
+        db.rollback()
+    finally:
+        db.close()
+
+    index = asyncio.run(typeahead.get_index())
+    assert [entry["uri"] for entry in index.search(word)] == [f"spotify:track:{word}-kept"]